@@ -225,21 +225,24 @@ class SecureVaultBackground {
 
             // 1. Try Native Host first for independence
             try {
-                const response = await new Promise((resolve, reject) => {
-                    chrome.runtime.sendNativeMessage('com.notionvault.passwords', {
-                        command: 'fetch',
-                        key: token
-                    }, (res) => {
-                        if (chrome.runtime.lastError) reject(chrome.runtime.lastError);
-                        else resolve(res);
-                    });
+                // lookup matches the origin in the host, so only this site's
+                // entries cross the native messaging channel
+                const response = await this.sendNative({
+                    command: 'lookup',
+                    key: token,
+                    origin: domain
                 });
 
                 if (response && response.entries) {
-                    return response.entries.filter(e =>
-                        (e.site || '').toLowerCase().includes(domain.toLowerCase()) ||
-                        domain.toLowerCase().includes((e.site || '').toLowerCase())
-                    );
+                    return response.entries;
+                }
+
+                // Hosts older than the lookup command only support fetch
+                if (response && response.error === 'Unknown command') {
+                    const all = await this.sendNative({ command: 'fetch', key: token });
+                    if (all && all.entries) {
+                        return this.filterBySite(all.entries, domain);
+                    }
                 }
             } catch (nativeError) {
                 console.log('Native host not available, trying API...');
@@ -258,10 +261,7 @@ class SecureVaultBackground {
 
                 const data = await res.json();
                 if (data.entries) {
-                    return data.entries.filter(e =>
-                        (e.site || '').toLowerCase().includes(domain.toLowerCase()) ||
-                        domain.toLowerCase().includes((e.site || '').toLowerCase())
-                    );
+                    return this.filterBySite(data.entries, domain);
                 }
             } catch (apiError) {
                 console.error('API not available or timeout');
@@ -274,6 +274,22 @@ class SecureVaultBackground {
         }
     }
 
+    sendNative(message) {
+        return new Promise((resolve, reject) => {
+            chrome.runtime.sendNativeMessage('com.notionvault.passwords', message, (res) => {
+                if (chrome.runtime.lastError) reject(chrome.runtime.lastError);
+                else resolve(res);
+            });
+        });
+    }
+
+    filterBySite(entries, domain) {
+        return entries.filter(e =>
+            (e.site || '').toLowerCase().includes(domain.toLowerCase()) ||
+            domain.toLowerCase().includes((e.site || '').toLowerCase())
+        );
+    }
+
     async fillCredentials(tabId, credentials) {
         try {
             await chrome.tabs.sendMessage(tabId, {
@@ -0,0 +1,84 @@
+// SecureVault Native Port
+// Keeps one connectNative port open and matches responses to requests by id.
+// Streamed responses ({"stream": true}) arrive as frames carrying
+// {id, seq, entries, done} ("changes" instead of "entries" for the changes
+// command); they are reassembled into one result of the same shape.
+
+class NativePort {
+    constructor(hostName) {
+        this.hostName = hostName;
+        this.port = null;
+        this.nextId = 1;
+        this.pending = new Map(); // id -> { resolve, reject, items, seq, onChunk }
+    }
+
+    connect() {
+        if (this.port) return this.port;
+
+        this.port = chrome.runtime.connectNative(this.hostName);
+        this.port.onMessage.addListener(this.handleFrame.bind(this));
+        this.port.onDisconnect.addListener(() => {
+            const error = new Error(
+                (chrome.runtime.lastError && chrome.runtime.lastError.message) ||
+                'Native host disconnected'
+            );
+            this.port = null;
+            for (const request of this.pending.values()) {
+                request.reject(error);
+            }
+            this.pending.clear();
+        });
+        return this.port;
+    }
+
+    // Send a message and resolve with its complete response. For streamed
+    // requests, onChunk (optional) receives each frame's items on arrival.
+    request(message, onChunk = null) {
+        const id = this.nextId++;
+        return new Promise((resolve, reject) => {
+            this.pending.set(id, { resolve, reject, items: [], seq: 0, onChunk });
+            try {
+                this.connect().postMessage({ ...message, id });
+            } catch (error) {
+                this.pending.delete(id);
+                reject(error);
+            }
+        });
+    }
+
+    handleFrame(frame) {
+        const request = frame ? this.pending.get(frame.id) : null;
+        if (!request) return;
+
+        // A plain, single-message response
+        if (frame.seq === undefined) {
+            this.pending.delete(frame.id);
+            request.resolve(frame);
+            return;
+        }
+
+        if (frame.seq !== request.seq) {
+            this.pending.delete(frame.id);
+            request.reject(new Error(`Frame ${frame.seq} arrived, expected ${request.seq}`));
+            return;
+        }
+        request.seq++;
+
+        const field = 'changes' in frame ? 'changes' : 'entries';
+        const items = frame[field] || [];
+        for (const item of items) {
+            request.items.push(item);
+        }
+        if (request.onChunk && items.length) {
+            request.onChunk(items);
+        }
+
+        if (frame.done) {
+            this.pending.delete(frame.id);
+            // Keep the frame's other fields, e.g. revision and reset
+            const { seq, done, ...result } = frame;
+            result[field] = request.items;
+            request.resolve(result);
+        }
+    }
+}
@@ -6,6 +6,7 @@ class VaultExtension {
         this.token = null;
         this.entries = [];
         this.mode = 'api'; // 'api' or 'native'
+        this.nativePort = new NativePort(NATIVE_HOST);
 
         this.views = {
             login: document.getElementById('loginView'),
@@ -184,12 +185,22 @@ class VaultExtension {
                 }
             } catch (e) { console.error(e); }
         } else {
-            chrome.runtime.sendNativeMessage(NATIVE_HOST, { command: 'fetch', key: this.token }, (response) => {
-                if (response && response.entries) {
+            // Streamed over a port, so vaults larger than Chrome's 1 MB
+            // message limit load, and the list fills in as frames arrive
+            this.entries = [];
+            try {
+                const response = await this.nativePort.request(
+                    { command: 'fetch', key: this.token, stream: true },
+                    (entries) => {
+                        this.entries = this.entries.concat(entries);
+                        this.renderList(this.inputs.search.value);
+                    }
+                );
+                if (response.entries) {
                     this.entries = response.entries;
-                    this.renderList();
+                    this.renderList(this.inputs.search.value);
                 }
-            });
+            } catch (e) { console.error(e); }
         }
     }
 
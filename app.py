@@ -4,7 +4,9 @@ from tkinter import ttk, simpledialog, messagebox
 import logging
 
 import styles
+from search_index import SearchIndex
 from db_handler import (
+    BlockCache,
     DatabaseManager,
     check_master_password,
     setup_new_vault,
@@ -200,11 +202,21 @@ class NotionVaultApp(tk.Tk):
         self.title("🔐 NotionVault")
         self.geometry("1024x640")
         styles.apply_dark_theme(self)
-        self.db = DatabaseManager(cipher)
+        self.db = DatabaseManager(cipher, cache=BlockCache())
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.index = SearchIndex()
+        self.index.build(self.db.iter_blocks())
+        logging.info(f"Search index built: {len(self.index)} blocks")
         self._build_ui()
         self.load_folders()
         logging.info("Application started.")
 
+    def on_close(self):
+        stats = self.db.cache.stats()
+        logging.info(f"Block cache: {stats['hits']} hits, {stats['misses']} misses")
+        self.db.wipe_cache()
+        self.destroy()
+
     def _build_ui(self):
         self.sidebar = ttk.Frame(self, width=240)
         self.sidebar.pack(side="left", fill="y")
@@ -244,9 +256,13 @@ class NotionVaultApp(tk.Tk):
                 toolbar, text=f"+ {b}", command=lambda t=b: self.add_block(t)
             ).pack(side="left", padx=4)
         self.search_var = tk.StringVar()
-        ttk.Entry(toolbar, textvariable=self.search_var, width=20).pack(
+        self.search_all = tk.BooleanVar(value=False)
+        ttk.Checkbutton(toolbar, text="All folders", variable=self.search_all).pack(
             side="right", padx=4
         )
+        search_entry = ttk.Entry(toolbar, textvariable=self.search_var, width=20)
+        search_entry.pack(side="right", padx=4)
+        search_entry.bind("<Return>", lambda e: self.search())
         ttk.Button(toolbar, text="Search", command=self.search).pack(side="right")
         self.canvas = tk.Canvas(
             right, bg=styles.colors["bg_dark"], highlightthickness=0
@@ -306,6 +322,7 @@ class NotionVaultApp(tk.Tk):
         fid, name = self.folders[idx]
         if messagebox.askyesno("Delete", "Confirm deletion?"):
             self.db.delete_folder(fid)
+            self.index.remove_folder(fid)
             logging.info(f"Folder deleted: {name}")
             self.load_folders()
 
@@ -316,8 +333,7 @@ class NotionVaultApp(tk.Tk):
         idx = sel[0]
         fid, _ = self.folders[idx]
         new_idx = max(0, min(len(self.folders) - 1, idx + delta))
-        other_id = self.folders[new_idx][0]
-        self.db.reorder_folder(fid, other_id)
+        self.db.shift_folder(fid, delta)
         self.load_folders()
         self.folder_lv.select_set(new_idx)
 
@@ -390,9 +406,10 @@ class NotionVaultApp(tk.Tk):
         if hasattr(dlg, "result") and dlg.result is not None:
             # For new text block types, store as dict with type and text
             if btype in ["Heading", "Title", "Paragraph", "Quote"]:
-                self.db.add_block(self.current_folder, btype, dlg.result)
+                bid = self.db.add_block(self.current_folder, btype, dlg.result)
             else:
-                self.db.add_block(self.current_folder, btype, dlg.result)
+                bid = self.db.add_block(self.current_folder, btype, dlg.result)
+            self.index.add(bid, self.current_folder, btype, dlg.result)
             logging.info(f"Block added: {btype}")
             self.load_blocks()
 
@@ -406,38 +423,29 @@ class NotionVaultApp(tk.Tk):
             dlg = TableDialog(self, "Edit Table", data)
         if hasattr(dlg, "result") and dlg.result is not None:
             self.db.update_block(bid, dlg.result)
+            self.index.update(bid, dlg.result)
             self.load_blocks()
 
     def delete_block(self, bid):
         if messagebox.askyesno("Delete", "Confirm deletion?"):
             self.db.delete_block(bid)
+            self.index.remove(bid)
             logging.info(f"Block deleted: {bid}")
             self.load_blocks()
 
     def move_block(self, bid, delta):
-        blocks = self.db.fetch_blocks(self.current_folder)
-        ids = [b[0] for b in blocks]
-        idx = ids.index(bid)
-        new_idx = max(0, min(len(ids) - 1, idx + delta))
-        swap_id = ids[new_idx]
-        self.db.reorder_block(swap_id, blocks[idx][0])
-        self.db.reorder_block(bid, blocks[new_idx][0])
+        self.db.shift_block(bid, delta)
         self.load_blocks()
 
     def search(self):
-        kw = self.search_var.get().lower()
+        kw = self.search_var.get()
+        folder = None if self.search_all.get() else self.current_folder
         for w in self.block_frame.winfo_children():
             w.destroy()
-        for bid, btype, data in self.db.fetch_blocks(self.current_folder):
-            text = ""
-            if btype == "Credential":
-                text = data["site"] + data["username"]
-            elif btype == "Text":
-                text = data
-            else:
-                text = " ".join(k + v for k, v in data)
-            if kw in text.lower():
-                self._create_block_widget(bid, btype, data)
+        for bid in self.index.search(kw, folder):
+            block = self.db.fetch_block(bid)
+            if block:
+                self._create_block_widget(bid, block["btype"], block["data"])
 
 
 # -------------------- Entry Point --------------------
@@ -5,7 +5,7 @@ a = Analysis(
     ['app.py'],
     pathex=[],
     binaries=[],
-    datas=[],
+    datas=[('public_suffix_list.dat', '.')],
     hiddenimports=[],
     hookspath=[],
     hooksconfig={},
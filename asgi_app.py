@@ -0,0 +1,270 @@
+"""ASGI serving mode for the web app.
+
+Requests are read and written on an asyncio event loop, and the Flask views
+in web_app.py run on a bounded thread pool, so URLs, payloads, sessions and
+metrics are identical to the waitress mode. A thread is only held while a
+view and its body are being produced; idle keep-alive connections, slow
+uploads and long-polls cost no thread.
+
+`GET /api/changes?since=N&wait=S` long-polls here: while the vault revision
+is still N the request waits on the event loop, up to S seconds (at most
+MAX_WAIT), for a write before the view runs. All waiters share a single
+revision poller.
+
+Run with `SERVER_MODE=asgi python web_app.py` (requires uvicorn), or point
+any ASGI server at `asgi_app:app`.
+
+Environment:
+    API_THREADS   threads running Flask views (default 16)
+"""
+import asyncio
+import io
+import logging
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from db_handler import get_pool
+from web_app import app as flask_app
+
+MAX_WAIT = 60.0
+POLL_INTERVAL = 0.25
+# Response bodies are sent in chunks of about DRAIN_BYTES, with at most
+# MAX_PENDING chunks buffered ahead of a slow client
+DRAIN_BYTES = 64 * 1024
+MAX_PENDING = 4
+
+
+def _read_revision():
+    row = get_pool().connection().execute(
+        "SELECT v FROM meta WHERE k='revision'"
+    ).fetchone()
+    return int(row[0]) if row else 0
+
+
+class RevisionWatcher:
+    """Lets many coroutines wait for the vault revision to move past a value.
+
+    One background task polls meta.revision while anyone is waiting, so the
+    number of idle long-poll clients does not affect database load.
+    """
+
+    def __init__(self, executor, interval: float = POLL_INTERVAL):
+        self._executor = executor
+        self._interval = interval
+        self._revision = None
+        self._changed = None
+        self._waiters = 0
+        self._task = None
+
+    async def _poll(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while self._waiters:
+                revision = await loop.run_in_executor(self._executor, _read_revision)
+                if revision != self._revision:
+                    self._revision = revision
+                    self._changed.set()
+                    self._changed = asyncio.Event()
+                await asyncio.sleep(self._interval)
+        finally:
+            self._task = None
+
+    async def wait_past(self, since: int, timeout: float):
+        """Return once the revision exceeds since, or after timeout seconds."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        if self._changed is None:
+            self._changed = asyncio.Event()
+        self._waiters += 1
+        try:
+            if self._task is None:
+                self._revision = await loop.run_in_executor(self._executor, _read_revision)
+                self._task = asyncio.ensure_future(self._poll())
+            while self._revision is not None and self._revision <= since:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return
+                try:
+                    await asyncio.wait_for(self._changed.wait(), remaining)
+                except asyncio.TimeoutError:
+                    return
+        finally:
+            self._waiters -= 1
+
+
+def _environ(scope, body: bytes):
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode().decode("latin-1"),
+        "PATH_INFO": scope["path"].encode().decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": str(server[0]),
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": "HTTP/" + scope.get("http_version", "1.1"),
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for raw_name, raw_value in scope.get("headers", []):
+        name = raw_name.decode("latin-1").upper().replace("-", "_")
+        value = raw_value.decode("latin-1")
+        if name in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            key = name
+        else:
+            key = "HTTP_" + name
+        if key in environ:
+            value = environ[key] + ("; " if key == "HTTP_COOKIE" else ",") + value
+        environ[key] = value
+    # The body is already buffered, including chunked uploads
+    environ["CONTENT_LENGTH"] = str(len(body))
+    return environ
+
+
+class _Stream:
+    """Carries one WSGI response from its pool thread to the event loop.
+
+    The view and its whole body run on a single pool thread, because SQLite
+    cursors and Flask's request context belong to the thread that created
+    them. Chunks are handed over as they are produced; once MAX_PENDING are
+    waiting to be sent, the thread blocks until the client catches up.
+    """
+
+    def __init__(self, loop):
+        self._loop = loop
+        self.queue = asyncio.Queue()
+        self._space = threading.Semaphore(MAX_PENDING)
+        self._cancelled = threading.Event()
+        self.status = 500
+        self.headers = []
+
+    def _put(self, item):
+        while not self._space.acquire(timeout=1):
+            if self._cancelled.is_set():
+                return False
+        self._loop.call_soon_threadsafe(self.queue.put_nowait, item)
+        return True
+
+    def run(self, environ):
+        def start_response(status, headers, exc_info=None):
+            self.status = int(status.split(" ", 1)[0])
+            self.headers = [(k.encode("latin-1"), v.encode("latin-1")) for k, v in headers]
+
+        try:
+            result = flask_app(environ, start_response)
+            try:
+                chunks, size = [], 0
+                for chunk in result:
+                    if chunk:
+                        chunks.append(chunk)
+                        size += len(chunk)
+                    if size >= DRAIN_BYTES:
+                        if not self._put((b"".join(chunks), True)):
+                            return
+                        chunks, size = [], 0
+                self._put((b"".join(chunks), False))
+            finally:
+                close = getattr(result, "close", None)
+                if close is not None:
+                    close()
+        except BaseException as e:
+            self._loop.call_soon_threadsafe(self.queue.put_nowait, e)
+
+    def sent(self):
+        self._space.release()
+
+    def cancel(self):
+        self._cancelled.set()
+
+
+class AsgiApp:
+    def __init__(self, threads: int = None):
+        self.executor = ThreadPoolExecutor(
+            threads or int(os.environ.get("API_THREADS", 16)), thread_name_prefix="api"
+        )
+        self.watcher = RevisionWatcher(self.executor)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self._lifespan(receive, send)
+        if scope["type"] != "http":
+            return
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+
+        if scope["path"] == "/api/changes" and scope["method"] == "GET":
+            await self._long_poll(scope)
+
+        loop = asyncio.get_running_loop()
+        stream = _Stream(loop)
+        loop.run_in_executor(self.executor, stream.run, _environ(scope, bytes(body)))
+        started = False
+        try:
+            while True:
+                item = await stream.queue.get()
+                if isinstance(item, BaseException):
+                    logging.error(f"{scope['method']} {scope['path']} failed: {item!r}")
+                    item = (b"", False)
+                    if not started:
+                        stream.status, stream.headers = 500, []
+                if not started:
+                    await send({"type": "http.response.start", "status": stream.status,
+                                "headers": stream.headers})
+                    started = True
+                chunk, more = item
+                await send({"type": "http.response.body", "body": chunk, "more_body": more})
+                stream.sent()
+                if not more:
+                    return
+        finally:
+            # Stops the view's thread early if the client went away mid-stream
+            stream.cancel()
+
+    async def _long_poll(self, scope):
+        params = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        try:
+            since = int(params["since"][0])
+            wait = min(MAX_WAIT, float(params["wait"][0]))
+        except (KeyError, ValueError):
+            return
+        headers = {k.lower() for k, _ in scope.get("headers", [])}
+        # Unauthenticated requests get their 401 straight away
+        if wait > 0 and (b"x-vault-key" in headers or b"cookie" in headers):
+            await self.watcher.wait_past(since, wait)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+app = AsgiApp()
+
+
+def run(host="0.0.0.0", port=5000):
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit("SERVER_MODE=asgi needs uvicorn: pip install uvicorn")
+    uvicorn.run(app, host=host, port=port, lifespan="on")
@@ -0,0 +1,234 @@
+"""Micro-benchmarks for the vault storage and crypto layers.
+
+Usage:
+    python benchmark.py cipher
+    python benchmark.py batch --rows 10000
+    python benchmark.py native --credentials 5000 --calls 20
+"""
+import argparse
+import base64
+import json
+import math
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from itertools import cycle
+
+from db_handler import ConnectionPool, DatabaseManager, SimpleCipher
+
+
+def _legacy_encrypt(key, text):
+    # Byte-at-a-time reference implementation the bulk engine must match
+    data = text.encode()
+    return base64.b64encode(bytes(b ^ k for b, k in zip(data, cycle(key)))).decode()
+
+
+def _legacy_decrypt(key, token):
+    data = base64.b64decode(token)
+    return bytes(b ^ k for b, k in zip(data, cycle(key))).decode()
+
+
+def _throughput(fn, payload_bytes, min_time=0.5):
+    runs = 0
+    start = time.perf_counter()
+    while True:
+        fn()
+        runs += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return payload_bytes * runs / elapsed / 1e6
+
+
+def bench_cipher(args):
+    cipher = SimpleCipher(key=os.urandom(32))
+    sizes = [("small", 200, 2000), ("large", 1_000_000, 1)]
+    print(f"{'block':<8}{'count':>8}{'legacy MB/s':>14}{'bulk MB/s':>12}{'batch MB/s':>13}")
+    for label, size, count in sizes:
+        texts = [os.urandom(size // 2).hex() for _ in range(count)]
+        tokens = [cipher.encrypt(t) for t in texts]
+        for text, token in zip(texts, tokens):
+            assert token == _legacy_encrypt(cipher.key, text), "ciphertext mismatch"
+        assert cipher.decrypt_many(tokens) == texts, "plaintext mismatch"
+
+        total = size * count
+        legacy = _throughput(
+            lambda: [_legacy_decrypt(cipher.key, t) for t in tokens], total, args.min_time
+        )
+        bulk = _throughput(
+            lambda: [cipher.decrypt(t) for t in tokens], total, args.min_time
+        )
+        batch = _throughput(lambda: cipher.decrypt_many(tokens), total, args.min_time)
+        print(f"{label:<8}{count:>8}{legacy:>14.2f}{bulk:>12.2f}{batch:>13.2f}")
+
+
+def _credential(i):
+    return {
+        "site": f"site{i}.example.com",
+        "username": f"user{i}",
+        "email": f"user{i}@example.com",
+        "password": os.urandom(12).hex(),
+        "notes": "",
+        "custom": {},
+    }
+
+
+def bench_batch(args):
+    cipher = SimpleCipher(key=os.urandom(32))
+    blocks = [("Credential", _credential(i)) for i in range(args.rows)]
+    tmp = tempfile.mkdtemp(prefix="nv-bench-")
+    try:
+        for label in ("unbatched", "batched"):
+            pool = ConnectionPool(os.path.join(tmp, f"{label}.db"))
+            db = DatabaseManager(cipher, pool=pool)
+            fid = db.add_folder("Bench")
+            start = time.perf_counter()
+            if label == "batched":
+                db.add_blocks(fid, blocks)
+            else:
+                for btype, content in blocks:
+                    db.add_block(fid, btype, content)
+            elapsed = time.perf_counter() - start
+            print(f"{label:<10}{args.rows:>8} rows {elapsed:>8.2f}s {args.rows / elapsed:>12.0f} rows/s")
+            pool.close_all()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _send_frame(stream, message):
+    data = json.dumps(message).encode()
+    stream.write(struct.pack("I", len(data)) + data)
+    stream.flush()
+
+
+def _read_frame(stream):
+    (length,) = struct.unpack("I", stream.read(4))
+    return json.loads(stream.read(length))
+
+
+def _spawned_call(argv, message, env):
+    """One message to a freshly started host process, as sendNativeMessage does."""
+    proc = subprocess.Popen(argv, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL, env=env)
+    _send_frame(proc.stdin, message)
+    proc.stdin.close()
+    reply = _read_frame(proc.stdout)
+    proc.stdout.close()
+    proc.wait()
+    return reply
+
+
+def _timed_calls(call, count):
+    times = []
+    for _ in range(count):
+        start = time.perf_counter()
+        reply = call()
+        times.append(time.perf_counter() - start)
+        assert "entries" in reply, reply
+    return sorted(times)
+
+
+def _report_latency(label, times):
+    p95 = times[max(1, math.ceil(0.95 * len(times))) - 1]
+    print(f"{label:<26}{len(times):>6}{times[len(times) // 2] * 1000:>10.1f}"
+          f"{p95 * 1000:>10.1f}{sum(times) / len(times) * 1000:>10.1f}")
+
+
+def bench_native(args):
+    from db_handler import setup_new_vault
+
+    tmp = tempfile.mkdtemp(prefix="nv-bench-")
+    cwd = os.getcwd()
+    # The host, launcher and daemon all use vault.db in their working directory
+    os.chdir(tmp)
+    env = dict(os.environ, VAULT_DAEMON_AUTOSTART="0")
+    python = sys.executable
+    daemon = None
+    try:
+        cipher = setup_new_vault("bench-password", iterations=args.kdf_iterations)
+        db = DatabaseManager(cipher)
+        fid = db.add_folder("Bench")
+        db.add_blocks(fid, [
+            ("Credential", dict(_credential(i), site=f"https://login.site{i % 2000}.net"))
+            for i in range(args.credentials)
+        ])
+        message = {"command": "lookup", "key": cipher.key.hex(),
+                   "origin": "https://site7.net", "id": 1}
+        print(f"lookup in a vault of {args.credentials} credentials")
+        print(f"{'path':<26}{'calls':>6}{'p50 ms':>10}{'p95 ms':>10}{'mean ms':>10}")
+
+        host = [python, os.path.join(HERE, "native_host.py")]
+        _report_latency("cold: native_host/call", _timed_calls(
+            lambda: _spawned_call(host, message, env), args.calls))
+
+        proc = subprocess.Popen(host, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, env=env)
+
+        def on_port():
+            _send_frame(proc.stdin, message)
+            return _read_frame(proc.stdout)
+
+        on_port()
+        _report_latency("warm: open native_host", _timed_calls(on_port, args.calls))
+        proc.stdin.close()
+        proc.wait()
+
+        import native_launcher
+
+        daemon = subprocess.Popen([python, os.path.join(HERE, "vault_daemon.py")],
+                                  stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.DEVNULL, env=env)
+        deadline = time.monotonic() + 10
+        sock = None
+        while sock is None and time.monotonic() < deadline:
+            time.sleep(0.05)
+            sock = native_launcher.connect()
+        if sock is None:
+            raise SystemExit("vault_daemon did not start")
+        launcher = [python, os.path.join(HERE, "native_launcher.py")]
+        _spawned_call(launcher, message, env)
+        _report_latency("warm: launcher/call", _timed_calls(
+            lambda: _spawned_call(launcher, message, env), args.calls))
+
+        rfile, wfile = sock.makefile("rb"), sock.makefile("wb")
+
+        def on_socket():
+            _send_frame(wfile, message)
+            return _read_frame(rfile)
+
+        _report_latency("warm: daemon socket", _timed_calls(on_socket, args.calls))
+        sock.close()
+    finally:
+        if daemon is not None:
+            daemon.terminate()
+            daemon.wait()
+        os.chdir(cwd)
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--min-time", type=float, default=0.5,
+                        help="seconds to spend on each measurement")
+    sub = parser.add_subparsers(dest="bench", required=True)
+    sub.add_parser("cipher", help="SimpleCipher decrypt throughput").set_defaults(func=bench_cipher)
+    p = sub.add_parser("batch", help="add_block loop vs. add_blocks in one transaction")
+    p.add_argument("--rows", type=int, default=10_000)
+    p.set_defaults(func=bench_batch)
+    p = sub.add_parser("native", help="native messaging latency: cold host vs. resident daemon")
+    p.add_argument("--credentials", type=int, default=5000)
+    p.add_argument("--calls", type=int, default=20, help="timed messages per path")
+    p.add_argument("--kdf-iterations", type=int, default=100_000)
+    p.set_defaults(func=bench_native)
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Keyed blind index over block contents.
+
+Blocks are indexed by HMAC tokens of their normalized hostnames and words,
+keyed from the vault key, so the `block_terms` table can be searched with
+plain SQL without revealing the plaintext terms.
+
+Usage:
+    python blind_index.py enable
+    python blind_index.py disable
+"""
+import hashlib
+import hmac
+import re
+from urllib.parse import urlsplit
+
+from public_suffix import is_ip, public_suffix
+from search_index import block_text
+
+_WORD_RE = re.compile(r"\w{2,}")
+
+def normalize_host(site: str) -> str:
+    """Lower-cased hostname of a URL or bare host, without port or leading www."""
+    site = (site or "").strip().lower()
+    if not site:
+        return ""
+    if "://" not in site:
+        site = "//" + site
+    try:
+        host = urlsplit(site).hostname or ""
+    except ValueError:
+        return ""
+    host = host.rstrip(".")
+    if host.startswith("www."):
+        host = host[4:]
+    return host
+
+
+def host_suffixes(host: str):
+    """The host and each parent domain down to (not including) its public suffix.
+
+    IP addresses, single labels and hosts that are themselves public
+    suffixes yield only the host.
+    """
+    if not host:
+        return []
+    if is_ip(host):
+        return [host]
+    labels = host.split(".")
+    floor = public_suffix(host).count(".") + 2
+    return [".".join(labels[i:]) for i in range(0, len(labels) - floor + 1)] or [host]
+
+
+def plain_terms(btype: str, data) -> set:
+    """Unkeyed index terms for a block: host suffixes of the site and its words."""
+    terms = {"word:" + w for w in _WORD_RE.findall(block_text(btype, data))}
+    if btype == "Credential" and isinstance(data, dict):
+        terms.update("host:" + h for h in host_suffixes(normalize_host(data.get("site"))))
+    return terms
+
+
+def query_terms(query: str = None, site: str = None):
+    """(all_of, any_of) term lists for a word query and/or a page site."""
+    all_of = sorted({"word:" + w for w in _WORD_RE.findall((query or "").lower())})
+    any_of = ["host:" + h for h in host_suffixes(normalize_host(site))] if site else []
+    return all_of, any_of
+
+
+def matches(terms: set, all_of, any_of) -> bool:
+    if any(t not in terms for t in all_of):
+        return False
+    return not any_of or any(t in terms for t in any_of)
+
+
+def index_key(vault_key: bytes) -> bytes:
+    return hmac.new(vault_key, b"notionvault/blind-index/v1", hashlib.sha256).digest()
+
+
+def blind(key: bytes, term: str) -> bytes:
+    return hmac.new(key, term.encode(), hashlib.sha256).digest()[:16]
+
+
+def main():
+    import argparse
+    import getpass
+
+    from db_handler import DatabaseManager, check_master_password
+
+    parser = argparse.ArgumentParser(description="Manage the vault's blind search index")
+    parser.add_argument("action", choices=["enable", "disable"])
+    args = parser.parse_args()
+    ok, cipher = check_master_password(getpass.getpass("Master password: "))
+    if not ok:
+        raise SystemExit("Incorrect password")
+    db = DatabaseManager(cipher)
+    if args.action == "enable":
+        print(f"Indexed {db.enable_blind_index()} blocks")
+    else:
+        db.disable_blind_index()
+        print("Blind index removed")
+
+
+if __name__ == "__main__":
+    main()
@@ -39,7 +39,7 @@ def main():
 
     # 4. Build Native Host
     print("\n--- Building Native Host ---")
-    run_command(f'"{sys.executable}" -m PyInstaller native_host.py --onefile --name notionvault_host --clean --noconfirm')
+    run_command(f'"{sys.executable}" -m PyInstaller native_host.py --onefile --name notionvault_host --add-data public_suffix_list.dat:. --clean --noconfirm')
 
     # 5. Organize Release Artifacts
     print("\n--- Organizing Artifacts ---")
@@ -0,0 +1,61 @@
+"""gzip/brotli compression of HTML and JSON responses.
+
+Brotli is used when the `brotli` package is installed and the client accepts
+it, otherwise gzip. Streamed and small responses are sent as they are.
+Compressed responses get a weak ETag, since their bytes differ from the
+identity encoding while the resource is the same.
+
+Environment:
+    COMPRESS_MIN_BYTES   smallest body worth compressing (default 1024)
+"""
+import gzip
+import os
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE = {"text/html", "text/plain", "text/css", "application/json",
+                "application/javascript"}
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def _encode(data: bytes, accept):
+    if brotli is not None and accept["br"]:
+        return "br", brotli.compress(data, quality=BROTLI_QUALITY)
+    if accept["gzip"]:
+        return "gzip", gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+    return None, data
+
+
+def _compress(response):
+    response.vary.add("Accept-Encoding")
+    if (
+        response.status_code < 200
+        or response.status_code in (204, 304)
+        or response.direct_passthrough
+        or response.is_streamed
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in COMPRESSIBLE
+    ):
+        return response
+    data = response.get_data()
+    if len(data) < int(os.environ.get("COMPRESS_MIN_BYTES", 1024)):
+        return response
+    encoding, body = _encode(data, request.accept_encodings)
+    if encoding is None or len(body) >= len(data):
+        return response
+    response.set_data(body)
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_app(app):
+    app.after_request(_compress)
@@ -1,88 +1,743 @@
-import os, sqlite3, base64, hashlib, json, datetime
-from itertools import cycle
+import os, sqlite3, base64, hashlib, json, datetime, threading, time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+
+import blind_index
+import migrations
+
+DB_PATH = "vault.db"
+
+# Key derivation; vaults without kdf_* rows in meta use these defaults
+KDF_ALGORITHM = "pbkdf2-sha256"
+DEFAULT_KDF_ITERATIONS = 200_000
+MIN_KDF_ITERATIONS = 100_000
+DEFAULT_KDF_DKLEN = 32
+
+
+class OpCounters(threading.local):
+    """Per-thread running totals of SQL statements and decryptions.
+
+    Callers measure a unit of work, such as a web request, by taking a
+    snapshot() before and after it on the same thread.
+    """
+
+    sql_statements = 0
+    decrypted_rows = 0
+    decrypted_bytes = 0
+
+    def snapshot(self):
+        return self.sql_statements, self.decrypted_rows, self.decrypted_bytes
+
+
+op_counters = OpCounters()
+
+
+class _CountingCursor(sqlite3.Cursor):
+    # executemany counts once: it is one statement however many rows it binds
+    def execute(self, *args):
+        op_counters.sql_statements += 1
+        return super().execute(*args)
+
+    def executemany(self, *args):
+        op_counters.sql_statements += 1
+        return super().executemany(*args)
+
+
+class _CountingConnection(sqlite3.Connection):
+    """Connection that counts the statements run through it or its cursors."""
+
+    def cursor(self, factory=_CountingCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args):
+        op_counters.sql_statements += 1
+        return super().execute(*args)
+
+    def executemany(self, *args):
+        op_counters.sql_statements += 1
+        return super().executemany(*args)
 
 
 class SimpleCipher:
-    def __init__(self, master_pwd: str = None, salt: bytes = None, key: bytes = None):
+    def __init__(
+        self,
+        master_pwd: str = None,
+        salt: bytes = None,
+        key: bytes = None,
+        iterations: int = DEFAULT_KDF_ITERATIONS,
+        dklen: int = DEFAULT_KDF_DKLEN,
+    ):
         if key:
              self.key = key
         elif master_pwd and salt:
             self.key = hashlib.pbkdf2_hmac(
-                "sha256", master_pwd.encode(), salt, 200_000, dklen=32
+                "sha256", master_pwd.encode(), salt, iterations, dklen=dklen
             )
         else:
             raise ValueError("Must provide key OR (master_pwd and salt)")
+        self._stream = self.key
+
+    def _keystream(self, n: int) -> bytes:
+        # The repeated key is cached and grown by doubling, so a whole folder
+        # of blocks shares one buffer instead of cycling the key per byte.
+        # Threads share a cipher, so read the buffer once and slice that copy:
+        # another thread may swap in a shorter one meanwhile.
+        stream = self._stream
+        if len(stream) < n:
+            reps = -(-n // len(self.key))
+            stream = self.key * max(reps, 2 * len(stream) // len(self.key))
+            self._stream = stream
+        return stream[:n]
+
+    def _xor(self, data: bytes) -> bytes:
+        n = len(data)
+        ks = int.from_bytes(self._keystream(n), "little")
+        return (int.from_bytes(data, "little") ^ ks).to_bytes(n, "little")
 
     def encrypt(self, text: str) -> str:
         if not text:
             return ""
-        data = text.encode()
-        xored = bytes(b ^ k for b, k in zip(data, cycle(self.key)))
-        return base64.b64encode(xored).decode()
+        return base64.b64encode(self._xor(text.encode())).decode()
 
     def decrypt(self, token: str) -> str:
         if not token:
             return ""
         try:
-            data = base64.b64decode(token)
-            pt = bytes(b ^ k for b, k in zip(data, cycle(self.key)))
-            return pt.decode()
+            raw = base64.b64decode(token)
+            op_counters.decrypted_rows += 1
+            op_counters.decrypted_bytes += len(raw)
+            return self._xor(raw).decode()
         except:
             return ""
 
+    def decrypt_many(self, tokens) -> list:
+        return [self.decrypt(t) for t in tokens]
+
+
+class ConnectionPool:
+    """Process-wide SQLite connections, one per thread, for a single vault file.
+
+    Connections are opened lazily in WAL mode and kept for the lifetime of the
+    thread, so request handlers skip the connect cost. Pending schema
+    migrations are applied once per pool instead of once per DatabaseManager.
+    """
+
+    def __init__(self, path: str = DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._conns = []
+        self._schema_ready = False
+        self.migration_report = []
+        self.checkouts = 0
+        self.checkout_time = 0.0
+        self.max_checkout_time = 0.0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, factory=_CountingConnection)
+        conn.execute("PRAGMA journal_mode=WAL")
+        migrations.configure(conn)
+        with self._lock:
+            self._conns.append(conn)
+            if not self._schema_ready:
+                self.migration_report = migrations.migrate(conn)
+                self._schema_ready = True
+        return conn
+
+    def connection(self):
+        start = time.perf_counter()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        elif conn.in_transaction and not getattr(self._local, "batches", 0):
+            # Left open by a write that failed outside a batch; it holds the
+            # write lock and nothing in it was meant to be committed
+            conn.rollback()
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.checkouts += 1
+            self.checkout_time += elapsed
+            self.max_checkout_time = max(self.max_checkout_time, elapsed)
+        return conn
+
+    def batch_opened(self):
+        """Mark a transaction open on this thread's connection (see DatabaseManager.batch)."""
+        self._local.batches = getattr(self._local, "batches", 0) + 1
+
+    def batch_closed(self):
+        self._local.batches -= 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "path": self.path,
+                "size": len(self._conns),
+                "checkouts": self.checkouts,
+                "avg_checkout_ms": (
+                    self.checkout_time / self.checkouts * 1000 if self.checkouts else 0.0
+                ),
+                "max_checkout_ms": self.max_checkout_time * 1000,
+            }
+
+    def close_all(self):
+        """Close every pooled connection; threads reconnect on next checkout."""
+        with self._lock:
+            conns, self._conns = self._conns, []
+            self._local = threading.local()
+            self._schema_ready = False
+        for conn in conns:
+            try:
+                conn.close()
+            except sqlite3.ProgrammingError:
+                # Owned by another thread; it is released when that thread exits
+                pass
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_commit_listeners = []
+
+
+def add_commit_listener(fn):
+    """Call fn(path) after each DatabaseManager transaction commits to path."""
+    _commit_listeners.append(fn)
+
+
+def _notify_commit(path: str):
+    for fn in _commit_listeners:
+        fn(path)
+
+
+def get_pool(path: str = DB_PATH) -> ConnectionPool:
+    with _pools_lock:
+        pool = _pools.get(path)
+        if pool is None:
+            pool = _pools[path] = ConnectionPool(path)
+        return pool
+
+
+class BlockCache:
+    """Bounded LRU of decrypted block payloads keyed by block id and ciphertext digest.
+
+    Cached values are shared between callers and must be treated as read-only.
+    The memory cap is approximate: each entry is charged for its ciphertext
+    length plus a fixed per-entry overhead.
+    """
+
+    MISS = object()
+    ENTRY_OVERHEAD = 256
+
+    def __init__(self, max_bytes: int = 8 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _digest(enc: str) -> bytes:
+        return hashlib.blake2b(enc.encode(), digest_size=16).digest()
+
+    def get(self, bid: int, enc: str):
+        digest = self._digest(enc)
+        with self._lock:
+            entry = self._entries.get(bid)
+            if entry is None or entry[0] != digest:
+                self.misses += 1
+                return self.MISS
+            self._entries.move_to_end(bid)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, bid: int, enc: str, data):
+        size = len(enc) + self.ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        digest = self._digest(enc)
+        with self._lock:
+            old = self._entries.pop(bid, None)
+            if old is not None:
+                self.bytes -= old[2]
+            self._entries[bid] = (digest, data, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self.bytes -= evicted
+
+    def invalidate(self, *bids):
+        with self._lock:
+            for bid in bids:
+                entry = self._entries.pop(bid, None)
+                if entry is not None:
+                    self.bytes -= entry[2]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+def _write(method):
+    """Run a DatabaseManager write in its own transaction, or the open batch."""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.batch():
+            return method(self, *args, **kwargs)
+    return wrapper
+
 
 class DatabaseManager:
-    def __init__(self, cipher: SimpleCipher):
+    def __init__(
+        self,
+        cipher: SimpleCipher,
+        pool: ConnectionPool = None,
+        cache: BlockCache = None,
+    ):
         self.cipher = cipher
-        self.conn = sqlite3.connect("vault.db")
-        self._init_db()
-
-    def _init_db(self):
-        c = self.conn.cursor()
-        # Meta for master password
-        c.execute("""CREATE TABLE IF NOT EXISTS meta (k TEXT PRIMARY KEY, v TEXT)""")
-        # Folders
-        c.execute("""CREATE TABLE IF NOT EXISTS folders (
-                       id INTEGER PRIMARY KEY AUTOINCREMENT,
-                       name TEXT NOT NULL,
-                       sort INTEGER DEFAULT 0
-                     )""")
-        # Blocks
-        c.execute("""CREATE TABLE IF NOT EXISTS blocks (
-                       id INTEGER PRIMARY KEY AUTOINCREMENT,
-                       folder_id INTEGER NOT NULL,
-                       type TEXT NOT NULL,
-                       content TEXT NOT NULL,
-                       sort INTEGER DEFAULT 0,
-                       FOREIGN KEY(folder_id) REFERENCES folders(id) ON DELETE CASCADE
-                     )""")
-        self.conn.commit()
+        self.pool = pool or get_pool()
+        self.conn = self.pool.connection()
+        self.cache = cache
+        self._batch_depth = 0
+        self._write_rev = None
+        self._blind_key = None
+
+    def _load_many(self, rows):
+        """Decode [(id, ciphertext)] into payloads, decrypting only cache misses."""
+        out = [BlockCache.MISS] * len(rows)
+        if self.cache is not None:
+            out = [self.cache.get(bid, enc) for bid, enc in rows]
+        todo = [i for i, data in enumerate(out) if data is BlockCache.MISS]
+        plain = self.cipher.decrypt_many([rows[i][1] for i in todo])
+        for i, text in zip(todo, plain):
+            try:
+                data = json.loads(text)
+            except:
+                data = {}
+            out[i] = data
+            if self.cache is not None:
+                self.cache.put(rows[i][0], rows[i][1], data)
+        return out
+
+    def _load(self, bid: int, enc: str):
+        return self._load_many([(bid, enc)])[0]
+
+    @contextmanager
+    def batch(self):
+        """Group every write made inside the block into one transaction.
+
+        Nested batches join the outermost one. The transaction is committed
+        once on exit, or rolled back if the block (or the commit) raises.
+        It takes the write lock up front, so reads made inside it (such as
+        the next sort position) cannot be raced by another process's write.
+        """
+        self._batch_depth += 1
+        if self._batch_depth == 1:
+            self.pool.batch_opened()
+        try:
+            if self._batch_depth == 1 and not self.conn.in_transaction:
+                self.conn.execute("BEGIN IMMEDIATE")
+            yield self
+            if self._batch_depth == 1:
+                self.conn.commit()
+        except BaseException:
+            self._batch_depth -= 1
+            if not self._batch_depth:
+                self.conn.rollback()
+                self._write_rev = None
+                self.pool.batch_closed()
+            raise
+        self._batch_depth -= 1
+        if not self._batch_depth:
+            self._write_rev = None
+            self.pool.batch_closed()
+            _notify_commit(self.pool.path)
+
+    def _bump_revision(self) -> int:
+        """Increment meta.revision once per transaction and return the new value."""
+        if self._write_rev is None:
+            self.conn.execute(
+                "UPDATE meta SET v = CAST(v AS INTEGER) + 1 WHERE k='revision'"
+            )
+            self._write_rev = self.revision()
+            if self._write_rev % self.CHANGES_COMPACT_EVERY == 0:
+                self._compact_changes(self.CHANGES_KEEP_REVISIONS)
+        return self._write_rev
+
+    # Change log
+    # Every block mutation is logged with the revision of its transaction, so
+    # clients can sync with changes_since(). Superseded rows are compacted
+    # every CHANGES_COMPACT_EVERY revisions and rows older than
+    # CHANGES_KEEP_REVISIONS are dropped, raising meta.changes_floor.
+    CHANGES_COMPACT_EVERY = 500
+    CHANGES_KEEP_REVISIONS = 10_000
+
+    def _log_changes(self, bids, op: str):
+        rev = self._bump_revision()
+        now = time.time()
+        self.conn.executemany(
+            "INSERT INTO changes (block_id, op, revision, ts) VALUES (?,?,?,?)",
+            [(bid, op, rev, now) for bid in bids],
+        )
+
+    def _meta_int(self, k: str) -> int:
+        row = self.conn.execute("SELECT v FROM meta WHERE k=?", (k,)).fetchone()
+        return int(row[0]) if row else 0
+
+    def compact_changes(self, keep_revisions: int = None):
+        """Drop superseded change rows, and rows older than keep_revisions."""
+        with self.batch():
+            self._compact_changes(keep_revisions)
+
+    def _compact_changes(self, keep_revisions: int = None):
+        # Keeping only the latest row per block never changes what
+        # changes_since() returns; pruning by age raises the floor instead
+        self.conn.execute(
+            """DELETE FROM changes WHERE id NOT IN
+               (SELECT MAX(id) FROM changes GROUP BY block_id)"""
+        )
+        if keep_revisions is not None:
+            horizon = self.revision() - keep_revisions
+            if horizon > self._meta_int("changes_floor"):
+                self.conn.execute("DELETE FROM changes WHERE revision <= ?", (horizon,))
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO meta (k,v) VALUES ('changes_floor',?)",
+                    (str(horizon),),
+                )
+
+    def changes_since(self, since: int):
+        """(revision, reset, changes) for Credential blocks changed after since.
+
+        changes holds ('upsert', id, folder_name, data) or ('delete', id, None,
+        None), one per block, in change order. reset is True when since is
+        older than the compacted log; the client must then refetch everything.
+        """
+        rev = self.revision()
+        if since < self._meta_int("changes_floor"):
+            return rev, True, []
+        rows = self.conn.execute(
+            """SELECT c.block_id, c.op, f.name, b.type, b.content FROM changes c
+               LEFT JOIN blocks b ON b.id = c.block_id
+               LEFT JOIN folders f ON f.id = b.folder_id
+               WHERE c.id IN (SELECT MAX(id) FROM changes WHERE revision > ?
+                              GROUP BY block_id)
+               ORDER BY c.id""",
+            (since,),
+        ).fetchall()
+        out = []
+        for bid, op, fname, btype, enc in rows:
+            if op == "delete" or enc is None:
+                out.append(("delete", bid, None, None))
+            elif btype == "Credential":
+                out.append(("upsert", bid, fname, self._load(bid, enc)))
+        return rev, False, out
+
+    def opens_vault(self) -> bool:
+        """Whether this manager's key is the vault's key."""
+        row = self.conn.execute("SELECT v FROM meta WHERE k='test'").fetchone()
+        return bool(row) and self.cipher.decrypt(row[0]) == "vault-test"
+
+    def revision(self) -> int:
+        """Monotonic vault revision, bumped by every committed write."""
+        row = self.conn.execute("SELECT v FROM meta WHERE k='revision'").fetchone()
+        return int(row[0]) if row else 0
+
+    def wipe_cache(self):
+        if self.cache is not None:
+            self.cache.clear()
+
+    # Blind index
+    @property
+    def blind_key(self):
+        """HMAC key for block_terms, or None while the blind index is disabled."""
+        if self._blind_key is None:
+            row = self.conn.execute("SELECT v FROM meta WHERE k='blind_index'").fetchone()
+            enabled = bool(row) and row[0] == "1"
+            self._blind_key = blind_index.index_key(self.cipher.key) if enabled else b""
+        return self._blind_key or None
+
+    def _index_blocks(self, blocks):
+        """Write block_terms rows for [(id, btype, data)] if the index is enabled."""
+        key = self.blind_key
+        if key is None:
+            return
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO block_terms (term, block_id) VALUES (?,?)",
+            [
+                (blind_index.blind(key, term), bid)
+                for bid, btype, data in blocks
+                for term in blind_index.plain_terms(btype, data)
+            ],
+        )
+
+    def _unindex_blocks(self, bids):
+        if self.blind_key is not None:
+            self.conn.executemany(
+                "DELETE FROM block_terms WHERE block_id=?", [(b,) for b in bids]
+            )
+
+    def enable_blind_index(self) -> int:
+        """Turn the blind index on and (re)build it from every block."""
+        with self.batch():
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (k,v) VALUES ('blind_index','1')"
+            )
+            self._blind_key = None
+            self.conn.execute("DELETE FROM block_terms")
+            blocks = [(bid, btype, data) for bid, _, btype, data in self.iter_blocks()]
+            self._index_blocks(blocks)
+        return len(blocks)
+
+    def disable_blind_index(self):
+        with self.batch():
+            self.conn.execute("DELETE FROM meta WHERE k='blind_index'")
+            self.conn.execute("DELETE FROM block_terms")
+        self._blind_key = None
+
+    def find_block_ids(self, query: str = None, site: str = None):
+        """Ids of blocks containing every word of query and matching site's host.
+
+        Returns None when the blind index is disabled so callers can fall back
+        to scanning.
+        """
+        key = self.blind_key
+        if key is None:
+            return None
+        all_of, any_of = blind_index.query_terms(query, site)
+        if not all_of and not any_of:
+            return []
+        ids = None
+        if all_of:
+            tokens = [blind_index.blind(key, t) for t in all_of]
+            rows = self.conn.execute(
+                f"""SELECT block_id FROM block_terms
+                    WHERE term IN ({",".join("?" * len(tokens))})
+                    GROUP BY block_id HAVING COUNT(*) = ?""",
+                (*tokens, len(tokens)),
+            )
+            ids = {r[0] for r in rows}
+        if any_of:
+            tokens = [blind_index.blind(key, t) for t in any_of]
+            rows = self.conn.execute(
+                f"""SELECT DISTINCT block_id FROM block_terms
+                    WHERE term IN ({",".join("?" * len(tokens))})""",
+                tokens,
+            )
+            hits = {r[0] for r in rows}
+            ids = hits if ids is None else ids & hits
+        return sorted(ids)
+
+    def search_credentials(self, query: str = None, site: str = None, after_id: int = None):
+        """Yield (id, folder_name, data) for Credential blocks matching query/site.
+
+        With the blind index enabled only the matching rows are decrypted;
+        otherwise every credential is decrypted and filtered in memory.
+        """
+        ids = self.find_block_ids(query, site)
+        if ids is None:
+            all_of, any_of = blind_index.query_terms(query, site)
+            for bid, fname, data in self.iter_credentials(after_id):
+                if blind_index.matches(
+                    blind_index.plain_terms("Credential", data), all_of, any_of
+                ):
+                    yield bid, fname, data
+            return
+        if after_id is not None:
+            ids = [bid for bid in ids if bid > after_id]
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            cur = self.conn.execute(
+                f"""SELECT b.id, f.name, b.content FROM blocks b
+                    JOIN folders f ON f.id = b.folder_id
+                    WHERE b.type = 'Credential' AND b.id IN ({",".join("?" * len(chunk))})
+                    ORDER BY b.id""",
+                chunk,
+            )
+            for bid, fname, enc in cur.fetchall():
+                yield bid, fname, self._load(bid, enc)
+
+    # Ordering
+    # sort holds fractional rank keys: a move writes the midpoint between the
+    # new neighbours, touching one row. When two neighbours are too close to
+    # split, their folder (or the folder list) is renumbered 1..n.
+    RANK_EPSILON = 1e-9
+
+    def _rebalance(self, table: str, scope_col: str = None, scope=None):
+        where, args = (f"WHERE {scope_col}=?", (scope,)) if scope_col else ("", ())
+        ids = [r[0] for r in self.conn.execute(
+            f"SELECT id FROM {table} {where} ORDER BY sort, id", args
+        )]
+        self.conn.executemany(
+            f"UPDATE {table} SET sort=? WHERE id=?",
+            [(i + 1, rid) for i, rid in enumerate(ids)],
+        )
+
+    def _rank_near(self, table, scope_col, rid, anchor, place_after):
+        """Sort key (and scope) placing rid right after or before anchor."""
+        if rid == anchor:
+            raise ValueError("Cannot move a row relative to itself")
+        # Checked before anything is written, so a bad id leaves the revision alone
+        if self.conn.execute(f"SELECT 1 FROM {table} WHERE id=?", (rid,)).fetchone() is None:
+            raise ValueError(f"No row {rid} in {table}")
+        cols = f"sort, {scope_col}" if scope_col else "sort, NULL"
+        row = self.conn.execute(
+            f"SELECT {cols} FROM {table} WHERE id=?", (anchor,)
+        ).fetchone()
+        if row is None:
+            raise ValueError(f"No row {anchor} in {table}")
+        sort, scope = row
+        where, args = (f"{scope_col}=? AND ", [scope]) if scope_col else ("", [])
+        if place_after:
+            nb = self.conn.execute(
+                f"""SELECT sort FROM {table} WHERE {where}(sort, id) > (?, ?) AND id != ?
+                    ORDER BY sort, id LIMIT 1""",
+                (*args, sort, anchor, rid),
+            ).fetchone()
+            lo, hi = sort, nb[0] if nb else None
+        else:
+            nb = self.conn.execute(
+                f"""SELECT sort FROM {table} WHERE {where}(sort, id) < (?, ?) AND id != ?
+                    ORDER BY sort DESC, id DESC LIMIT 1""",
+                (*args, sort, anchor, rid),
+            ).fetchone()
+            lo, hi = nb[0] if nb else None, sort
+        if lo is None:
+            return hi - 1, scope
+        if hi is None:
+            return lo + 1, scope
+        if hi - lo < self.RANK_EPSILON:
+            self._rebalance(table, scope_col, scope)
+            return self._rank_near(table, scope_col, rid, anchor, place_after)
+        return (lo + hi) / 2, scope
+
+    def _adjacent(self, table, scope_col, rid, step):
+        """Id of the row step (+1/-1) positions away from rid, or None."""
+        op, order = (">", "ASC") if step > 0 else ("<", "DESC")
+        scope = f"AND o.{scope_col} = r.{scope_col}" if scope_col else ""
+        row = self.conn.execute(
+            f"""SELECT o.id FROM {table} r JOIN {table} o
+                WHERE r.id=? {scope} AND (o.sort, o.id) {op} (r.sort, r.id)
+                ORDER BY o.sort {order}, o.id {order} LIMIT 1""",
+            (rid,),
+        ).fetchone()
+        return row[0] if row else None
+
+    @_write
+    def move_folder(self, fid: int, before: int = None, after: int = None):
+        """Place folder fid directly before or after another folder."""
+        if (before is None) == (after is None):
+            raise ValueError("Give exactly one of before/after")
+        rank, _ = self._rank_near(
+            "folders", None, fid, after if before is None else before, before is None
+        )
+        self.conn.execute("UPDATE folders SET sort=? WHERE id=?", (rank, fid))
+        self._bump_revision()
+
+    def shift_folder(self, fid: int, step: int) -> bool:
+        """Move a folder one position up (-1) or down (+1); False at either end."""
+        other = self._adjacent("folders", None, fid, step)
+        if other is None:
+            return False
+        if step > 0:
+            self.move_folder(fid, after=other)
+        else:
+            self.move_folder(fid, before=other)
+        return True
+
+    @_write
+    def move_block(self, bid: int, before: int = None, after: int = None):
+        """Place block bid directly before or after another block.
+
+        The block joins the anchor's folder. Only bid's row is written and
+        nothing is decrypted.
+        """
+        if (before is None) == (after is None):
+            raise ValueError("Give exactly one of before/after")
+        rank, folder_id = self._rank_near(
+            "blocks", "folder_id", bid, after if before is None else before, before is None
+        )
+        cur = self.conn.execute(
+            "UPDATE blocks SET sort=?, folder_id=? WHERE id=? AND folder_id != ?",
+            (rank, folder_id, bid, folder_id),
+        )
+        if cur.rowcount:
+            # Changing folders changes the synced entry
+            self._log_changes([bid], "update")
+        else:
+            self.conn.execute("UPDATE blocks SET sort=? WHERE id=?", (rank, bid))
+        self._bump_revision()
+
+    def shift_block(self, bid: int, step: int) -> bool:
+        """Move a block one position up (-1) or down (+1) within its folder."""
+        other = self._adjacent("blocks", "folder_id", bid, step)
+        if other is None:
+            return False
+        if step > 0:
+            self.move_block(bid, after=other)
+        else:
+            self.move_block(bid, before=other)
+        return True
 
     # Folder CRUD + reorder
+    @_write
     def add_folder(self, name: str) -> int:
         cur = self.conn.cursor()
         cur.execute("SELECT COALESCE(MAX(sort),0) FROM folders")
         nxt = cur.fetchone()[0] + 1
         cur.execute("INSERT INTO folders (name,sort) VALUES (?,?)", (name, nxt))
-        self.conn.commit()
+        self._bump_revision()
         return cur.lastrowid
 
+    def has_folder(self, fid: int) -> bool:
+        return self.conn.execute("SELECT 1 FROM folders WHERE id=?", (fid,)).fetchone() is not None
+
     def fetch_folders(self):
-        return self.conn.execute("SELECT id,name FROM folders ORDER BY sort").fetchall()
+        return self.conn.execute("SELECT id,name FROM folders ORDER BY sort, id").fetchall()
+
+    def folder_revision(self, fid: int):
+        """Counter bumped (by trigger) on every write to the folder's blocks; None if missing."""
+        row = self.conn.execute("SELECT rev FROM folders WHERE id=?", (fid,)).fetchone()
+        return row[0] if row else None
 
+    @_write
     def update_folder(self, fid: int, name: str):
         self.conn.execute("UPDATE folders SET name=? WHERE id=?", (name, fid))
-        self.conn.commit()
+        self._log_changes(
+            [r[0] for r in self.conn.execute("SELECT id FROM blocks WHERE folder_id=?", (fid,))],
+            "update",
+        )
+        self._bump_revision()
 
+    @_write
     def delete_folder(self, fid: int):
+        bids = [r[0] for r in self.conn.execute(
+            "SELECT id FROM blocks WHERE folder_id=?", (fid,)
+        )]
+        self._unindex_blocks(bids)
         self.conn.execute("DELETE FROM folders WHERE id=?", (fid,))
-        self.conn.commit()
+        self._log_changes(bids, "delete")
+        self._bump_revision()
+        if self.cache is not None:
+            self.cache.invalidate(*bids)
 
+    @_write
     def reorder_folder(self, fid: int, new_sort: int):
         self.conn.execute("UPDATE folders SET sort=? WHERE id=?", (new_sort, fid))
-        self.conn.commit()
+        self._bump_revision()
 
     # Block CRUD + reorder
+    @_write
     def add_block(self, folder_id: int, btype: str, content: dict) -> int:
         cur = self.conn.cursor()
         cur.execute(
@@ -91,62 +746,276 @@ class DatabaseManager:
         nxt = cur.fetchone()[0] + 1
         enc = self.cipher.encrypt(json.dumps(content))
         cur.execute(
-            "INSERT INTO blocks (folder_id,type,content,sort) VALUES (?,?,?,?)",
-            (folder_id, btype, enc, nxt),
+            """INSERT INTO blocks (folder_id,type,content,sort,size,updated_at)
+               VALUES (?,?,?,?,?,?)""",
+            (folder_id, btype, enc, nxt, len(enc), time.time()),
         )
-        self.conn.commit()
-        return cur.lastrowid
+        bid = cur.lastrowid
+        self._index_blocks([(bid, btype, content)])
+        self._log_changes([bid], "insert")
+        self._bump_revision()
+        return bid
 
     def fetch_blocks(self, folder_id: int):
         rows = self.conn.execute(
-            "SELECT id,type,content FROM blocks WHERE folder_id=? ORDER BY sort",
+            "SELECT id,type,content FROM blocks WHERE folder_id=? ORDER BY sort, id",
             (folder_id,),
         ).fetchall()
-        out = []
-        for bid, btype, enc in rows:
-            try:
-                data = json.loads(self.cipher.decrypt(enc))
-            except:
-                data = {}
-            out.append((bid, btype, data))
-        return out
+        payloads = self._load_many([(bid, enc) for bid, _, enc in rows])
+        return [(bid, btype, data) for (bid, btype, _), data in zip(rows, payloads)]
+
+    def iter_blocks(self):
+        """Yield (id, folder_id, type, data) for every block in display order."""
+        cur = self.conn.execute(
+            """SELECT b.id, b.folder_id, b.type, b.content FROM blocks b
+               JOIN folders f ON f.id = b.folder_id
+               ORDER BY f.sort, f.id, b.sort, b.id"""
+        )
+        for bid, fid, btype, enc in cur:
+            yield bid, fid, btype, self._load(bid, enc)
+
+    def iter_credentials(self, after_id: int = None, limit: int = None):
+        """Yield (id, folder_name, data) for every Credential block in one query.
 
+        Rows come in id order, starting after after_id when given. They are
+        streamed from the cursor and each one is decrypted only when it is
+        yielded, so callers can stop early without paying for the rest.
+        """
+        cur = self.conn.execute(
+            """SELECT b.id, f.name, b.content FROM blocks b
+               JOIN folders f ON f.id = b.folder_id
+               WHERE b.type = 'Credential' AND b.id > ?
+               ORDER BY b.id LIMIT ?""",
+            (after_id or 0, -1 if limit is None else limit),
+        )
+        for bid, fname, enc in cur:
+            yield bid, fname, self._load(bid, enc)
+
+    def add_blocks(self, folder_id: int, blocks) -> list:
+        """Insert [(btype, content)] at the end of a folder in one transaction.
+
+        Returns the new block ids in input order.
+        """
+        blocks = list(blocks)
+        with self.batch():
+            cur = self.conn.cursor()
+            cur.execute(
+                "SELECT COALESCE(MAX(sort),0) FROM blocks WHERE folder_id=?", (folder_id,)
+            )
+            nxt = cur.fetchone()[0] + 1
+            now = time.time()
+            rows = []
+            for i, (btype, content) in enumerate(blocks):
+                enc = self.cipher.encrypt(json.dumps(content))
+                rows.append((folder_id, btype, enc, nxt + i, len(enc), now))
+            cur.executemany(
+                """INSERT INTO blocks (folder_id,type,content,sort,size,updated_at)
+                   VALUES (?,?,?,?,?,?)""",
+                rows,
+            )
+            # batch() holds the write lock, so everything at or past nxt in
+            # this folder was inserted above
+            ids = [r[0] for r in cur.execute(
+                "SELECT id FROM blocks WHERE folder_id=? AND sort>=? ORDER BY sort",
+                (folder_id, nxt),
+            )]
+            self._index_blocks(
+                (bid, btype, content) for bid, (btype, content) in zip(ids, blocks)
+            )
+            self._log_changes(ids, "insert")
+        return ids
+
+    @_write
     def update_block(self, bid: int, content: dict):
         enc = self.cipher.encrypt(json.dumps(content))
-        self.conn.execute("UPDATE blocks SET content=? WHERE id=?", (enc, bid))
-        self.conn.commit()
+        self.conn.execute(
+            "UPDATE blocks SET content=?, size=?, updated_at=? WHERE id=?",
+            (enc, len(enc), time.time(), bid),
+        )
+        self._reindex_blocks([(bid, content)])
+        self._log_changes([bid], "update")
+        self._bump_revision()
+        if self.cache is not None:
+            self.cache.invalidate(bid)
+
+    def update_blocks(self, blocks):
+        """Re-encrypt [(id, content)] in one transaction."""
+        blocks = list(blocks)
+        now = time.time()
+        rows = []
+        for bid, content in blocks:
+            enc = self.cipher.encrypt(json.dumps(content))
+            rows.append((enc, len(enc), now, bid))
+        with self.batch():
+            self.conn.executemany(
+                "UPDATE blocks SET content=?, size=?, updated_at=? WHERE id=?", rows
+            )
+            self._reindex_blocks(blocks)
+            self._log_changes([bid for bid, _ in blocks], "update")
+        if self.cache is not None:
+            self.cache.invalidate(*(bid for bid, _ in blocks))
+
+    def _reindex_blocks(self, blocks):
+        if self.blind_key is None:
+            return
+        blocks = list(blocks)
+        bids = [bid for bid, _ in blocks]
+        self._unindex_blocks(bids)
+        types = {}
+        for start in range(0, len(bids), 500):
+            chunk = bids[start:start + 500]
+            types.update(self.conn.execute(
+                f"SELECT id, type FROM blocks WHERE id IN ({','.join('?' * len(chunk))})",
+                chunk,
+            ))
+        self._index_blocks(
+            (bid, types[bid], content) for bid, content in blocks if bid in types
+        )
+
+    def block_type(self, bid: int):
+        """The block's type, or None if there is no such block."""
+        row = self.conn.execute("SELECT type FROM blocks WHERE id=?", (bid,)).fetchone()
+        return row[0] if row else None
 
     def fetch_block(self, bid: int):
         res = self.conn.execute("SELECT id, type, content FROM blocks WHERE id = ?", (bid,))
         row = res.fetchone()
         if row:
             bid, btype, enc_data = row
-            data = json.loads(self.cipher.decrypt(enc_data))
-            return {'id': bid, 'btype': btype, 'data': data}
+            return {'id': bid, 'btype': btype, 'data': self._load(bid, enc_data)}
         return None
 
-    
-
+    @_write
     def delete_block(self, bid: int):
+        self._unindex_blocks([bid])
         self.conn.execute("DELETE FROM blocks WHERE id=?", (bid,))
-        self.conn.commit()
+        self._log_changes([bid], "delete")
+        self._bump_revision()
+        if self.cache is not None:
+            self.cache.invalidate(bid)
 
+    def delete_blocks(self, bids):
+        bids = list(bids)
+        with self.batch():
+            self._unindex_blocks(bids)
+            self.conn.executemany("DELETE FROM blocks WHERE id=?", [(b,) for b in bids])
+            self._log_changes(bids, "delete")
+        if self.cache is not None:
+            self.cache.invalidate(*bids)
+
+    @_write
     def reorder_block(self, bid: int, new_sort: int):
         self.conn.execute("UPDATE blocks SET sort=? WHERE id=?", (new_sort, bid))
-        self.conn.commit()
+        self._bump_revision()
 
 
-# Master password helpers
-import base64
+# KDF parameters
+def calibrate_kdf_iterations(target_seconds: float, probe: int = 20_000) -> int:
+    """PBKDF2 iteration count that takes about target_seconds on this host."""
+    best = float("inf")
+    for _ in range(3):
+        start = time.perf_counter()
+        hashlib.pbkdf2_hmac("sha256", b"calibration", os.urandom(16), probe, dklen=32)
+        best = min(best, time.perf_counter() - start)
+    iterations = int(probe * target_seconds / max(best, 1e-6))
+    return max(MIN_KDF_ITERATIONS, round(iterations, -3))
 
 
-def check_master_password(password: str):
-    conn = sqlite3.connect("vault.db")
+def load_kdf_params(conn) -> dict:
+    rows = dict(conn.execute("SELECT k, v FROM meta WHERE k LIKE 'kdf_%'").fetchall())
+    algorithm = rows.get("kdf_algorithm", KDF_ALGORITHM)
+    if algorithm != KDF_ALGORITHM:
+        raise ValueError(f"Unsupported KDF: {algorithm}")
+    return {
+        "iterations": int(rows.get("kdf_iterations", DEFAULT_KDF_ITERATIONS)),
+        "dklen": int(rows.get("kdf_dklen", DEFAULT_KDF_DKLEN)),
+    }
+
+
+def _store_kdf_params(conn, salt: bytes, iterations: int, dklen: int, replace: bool = False):
+    """Write the salt and KDF rows; unless replace, fail if a salt already exists."""
+    conn.execute(
+        f"INSERT {'OR REPLACE ' if replace else ''}INTO meta (k,v) VALUES ('salt',?)",
+        (base64.b64encode(salt).decode(),),
+    )
+    conn.executemany(
+        "INSERT OR REPLACE INTO meta (k,v) VALUES (?,?)",
+        [
+            ("kdf_algorithm", KDF_ALGORITHM),
+            ("kdf_iterations", str(iterations)),
+            ("kdf_dklen", str(dklen)),
+        ],
+    )
+
+
+def _resolve_iterations(iterations: int = None, target_seconds: float = None) -> int:
+    if iterations is None and target_seconds is None and os.environ.get("KDF_TARGET_MS"):
+        target_seconds = float(os.environ["KDF_TARGET_MS"]) / 1000
+    if iterations is None:
+        if target_seconds is None:
+            return DEFAULT_KDF_ITERATIONS
+        return calibrate_kdf_iterations(target_seconds)
+    return max(MIN_KDF_ITERATIONS, iterations)
+
+
+def upgrade_kdf(
+    password: str,
+    iterations: int = None,
+    target_seconds: float = None,
+    dklen: int = DEFAULT_KDF_DKLEN,
+    pool: ConnectionPool = None,
+):
+    """Re-derive the vault key with new KDF parameters and re-encrypt in place.
+
+    Every block, the password check value and (if enabled) the blind index
+    are rewritten in one transaction under a fresh salt. Returns the new
+    cipher, or None if the password is wrong. Keys held by existing web
+    sessions and extensions stop working.
+    """
+    pool = pool or get_pool()
+    ok, old = check_master_password(password, pool)
+    if not ok:
+        return None
+    salt = os.urandom(16)
+    iterations = _resolve_iterations(iterations, target_seconds)
+    new = SimpleCipher(password, salt, iterations=iterations, dklen=dklen)
+    db = DatabaseManager(old, pool=pool)
+    with db.batch():
+        rows = db.conn.execute("SELECT id, content FROM blocks").fetchall()
+        db.conn.executemany(
+            "UPDATE blocks SET content=?, size=? WHERE id=?",
+            [
+                (enc, len(enc), bid)
+                for bid, enc in (
+                    (bid, new.encrypt(old.decrypt(content))) for bid, content in rows
+                )
+            ],
+        )
+        _store_kdf_params(db.conn, salt, iterations, dklen, replace=True)
+        db.conn.execute(
+            "INSERT OR REPLACE INTO meta (k,v) VALUES ('test',?)",
+            (new.encrypt("vault-test"),),
+        )
+        # Every entry changed under a new key; synced clients must start over
+        db.conn.execute(
+            "INSERT OR REPLACE INTO meta (k,v) VALUES ('changes_floor',?)",
+            (str(db._bump_revision()),),
+        )
+        if db.blind_key is not None:
+            db.cipher = new
+            db._blind_key = None
+            db.enable_blind_index()
+    return new
+
+
+# Master password helpers
+def check_master_password(password: str, pool: ConnectionPool = None):
+    conn = (pool or get_pool()).connection()
     row = conn.execute("SELECT v FROM meta WHERE k='salt'").fetchone()
     if not row:
         return False, None
     salt = base64.b64decode(row[0])
-    cipher = SimpleCipher(password, salt)
+    cipher = SimpleCipher(password, salt, **load_kdf_params(conn))
     try:
         test = conn.execute("SELECT v FROM meta WHERE k='test'").fetchone()[0]
         if cipher.decrypt(test) == "vault-test":
@@ -156,16 +1025,35 @@ def check_master_password(password: str):
     return False, None
 
 
-def setup_new_vault(password: str):
-    conn = sqlite3.connect("vault.db")
-    conn.execute("CREATE TABLE IF NOT EXISTS meta (k TEXT PRIMARY KEY, v TEXT)")
+def setup_new_vault(
+    password: str,
+    pool: ConnectionPool = None,
+    iterations: int = None,
+    target_seconds: float = None,
+):
+    """Create the vault's key material.
+
+    The KDF iteration count is, in order of precedence: iterations, a count
+    calibrated for target_seconds, one calibrated for the KDF_TARGET_MS
+    environment variable, or DEFAULT_KDF_ITERATIONS.
+    """
+    conn = (pool or get_pool()).connection()
+    if conn.execute("SELECT 1 FROM meta WHERE k='salt'").fetchone():
+        raise ValueError("Vault is already set up")
     salt = os.urandom(16)
-    cipher = SimpleCipher(password, salt)
-    conn.execute(
-        "INSERT INTO meta (k,v) VALUES ('salt',?)", (base64.b64encode(salt).decode(),)
-    )
-    conn.execute(
-        "INSERT INTO meta (k,v) VALUES ('test',?)", (cipher.encrypt("vault-test"),)
-    )
-    conn.commit()
+    iterations = _resolve_iterations(iterations, target_seconds)
+    cipher = SimpleCipher(password, salt, iterations=iterations)
+    try:
+        # A concurrent setup that got here first makes the salt insert fail
+        _store_kdf_params(conn, salt, iterations, DEFAULT_KDF_DKLEN)
+        conn.execute(
+            "INSERT INTO meta (k,v) VALUES ('test',?)", (cipher.encrypt("vault-test"),)
+        )
+        conn.commit()
+    except sqlite3.IntegrityError:
+        conn.rollback()
+        raise ValueError("Vault is already set up")
+    except BaseException:
+        conn.rollback()
+        raise
     return cipher
@@ -0,0 +1,64 @@
+"""Cache of rendered page fragments for the web dashboard.
+
+Entries belong to an owner (a logged-in vault key) and are keyed by a name
+such as a folder id. Each stores the revision it was rendered at and is only
+returned while that revision is current. The total size of cached HTML is
+capped, and the least recently used entries are evicted first.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def owner_id(key_hex: str) -> str:
+    """Cache owner for a session's vault key, without keeping the key itself."""
+    return hashlib.blake2b(key_hex.encode(), digest_size=16).hexdigest()
+
+
+class FragmentCache:
+    def __init__(self, max_bytes: int = 16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # (owner, name) -> (revision, html)
+        self._lock = threading.Lock()
+
+    def get(self, owner: str, name, revision):
+        with self._lock:
+            entry = self._entries.get((owner, name))
+            if entry is None or entry[0] != revision:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((owner, name))
+            self.hits += 1
+            return entry[1]
+
+    def put(self, owner: str, name, revision, html: str):
+        size = len(html)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop((owner, name), None)
+            if old is not None:
+                self.bytes -= len(old[1])
+            self._entries[(owner, name)] = (revision, html)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.bytes -= len(evicted)
+
+    def drop_owner(self, owner: str):
+        """Forget everything rendered for an owner, e.g. on logout."""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == owner]:
+                self.bytes -= len(self._entries.pop(key)[1])
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -0,0 +1,64 @@
+"""In-memory hostname index of credentials for origin lookups.
+
+Credentials are keyed by the host of their `site`, so a page origin is
+answered by looking up the page's host and each of its parent domains
+instead of scanning the vault. An exact host match ranks first, then
+entries saved for parent domains, closest first. Parents stop short of the
+public suffix, and credentials saved for sibling or child hosts are never
+returned, so a page only gets credentials that were saved for it.
+"""
+from collections import defaultdict
+
+from blind_index import host_suffixes, normalize_host
+
+
+class HostIndex:
+    def __init__(self):
+        self._entries = {}  # bid -> (host, data)
+        self._hosts = defaultdict(set)  # host -> bids
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, bid: int, data):
+        if bid in self._entries:
+            self.remove(bid)
+        host = normalize_host(data.get("site") if isinstance(data, dict) else None)
+        # Entries without a usable host are kept so sync() can skip them too
+        self._entries[bid] = (host, data)
+        if host:
+            self._hosts[host].add(bid)
+
+    def remove(self, bid: int):
+        entry = self._entries.pop(bid, None)
+        if entry is None or not entry[0]:
+            return
+        ids = self._hosts.get(entry[0])
+        if ids is not None:
+            ids.discard(bid)
+            if not ids:
+                del self._hosts[entry[0]]
+
+    def sync(self, credentials):
+        """Bring the index in line with an iterable of (bid, data).
+
+        Payloads that are the same objects as last time are skipped, so
+        syncing against successive read-model snapshots only re-parses the
+        rows that changed.
+        """
+        seen = set()
+        for bid, data in credentials:
+            seen.add(bid)
+            entry = self._entries.get(bid)
+            if entry is None or entry[1] is not data:
+                self.add(bid, data)
+        for bid in [b for b in self._entries if b not in seen]:
+            self.remove(bid)
+
+    def lookup(self, origin: str):
+        """[(bid, data)] of credentials for a page origin or URL, best match first."""
+        page_host = normalize_host(origin)
+        hits = []
+        for host in host_suffixes(page_host):
+            hits.extend(sorted(self._hosts.get(host, ())))
+        return [(bid, self._entries[bid][1]) for bid in hits]
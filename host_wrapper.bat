@@ -1,3 +1,3 @@
 @echo off
 cd /d "%~dp0"
-".venv\Scripts\python.exe" native_host.py
+".venv\Scripts\python.exe" native_launcher.py
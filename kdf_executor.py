@@ -0,0 +1,180 @@
+"""Bounded worker pool and per-client backoff for master-password checks.
+
+PBKDF2 at vault strength takes hundreds of milliseconds of CPU. Running it on
+the web server's request threads lets a burst of logins hold every thread, so
+key derivation is handed to a small dedicated pool instead. Work beyond the
+pool's queue limit is refused immediately rather than queued without bound.
+
+Environment:
+    KDF_WORKERS   threads deriving keys (default 2)
+    KDF_QUEUE     submissions allowed to wait for a thread (default 4)
+"""
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class KdfBusy(Exception):
+    """Raised when the KDF pool and its queue are full."""
+
+
+class LoginThrottled(Exception):
+    """Raised when a client must wait `retry_after` seconds before another attempt."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+
+
+class KdfExecutor:
+    def __init__(self, workers: int = None, queue_limit: int = None):
+        self.workers = workers or int(os.environ.get("KDF_WORKERS", 2))
+        self.queue_limit = (
+            queue_limit if queue_limit is not None else int(os.environ.get("KDF_QUEUE", 4))
+        )
+        self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix="kdf")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._running = 0
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.kdf_seconds = 0.0
+        self.kdf_max = 0.0
+        self.wait_seconds = 0.0
+
+    def run(self, fn, *args, **kwargs):
+        """Run fn in the pool and wait for its result.
+
+        Raises KdfBusy without waiting when `workers + queue_limit`
+        submissions are already pending.
+        """
+        with self._lock:
+            if self._pending >= self.workers + self.queue_limit:
+                self.rejected += 1
+                raise KdfBusy()
+            self._pending += 1
+            self.submitted += 1
+        queued = time.perf_counter()
+
+        def task():
+            start = time.perf_counter()
+            with self._lock:
+                self._running += 1
+                self.wait_seconds += start - queued
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                with self._lock:
+                    self._running -= 1
+                    self._pending -= 1
+                    self.completed += 1
+                    self.kdf_seconds += elapsed
+                    self.kdf_max = max(self.kdf_max, elapsed)
+
+        try:
+            future = self._pool.submit(task)
+        except BaseException:
+            with self._lock:
+                self._pending -= 1
+            raise
+        return future.result()
+
+    def stats(self):
+        with self._lock:
+            done = self.completed or 1
+            return {
+                "workers": self.workers,
+                "queue_limit": self.queue_limit,
+                "running": self._running,
+                "queued": self._pending - self._running,
+                "submitted": self.submitted,
+                "rejected": self.rejected,
+                "completed": self.completed,
+                "kdf_seconds_total": self.kdf_seconds,
+                "kdf_seconds_avg": self.kdf_seconds / done,
+                "kdf_seconds_max": self.kdf_max,
+                "wait_seconds_avg": self.wait_seconds / done,
+            }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
+
+
+class LoginLimiter:
+    """Per-client login throttle.
+
+    A client may have one password check in flight at a time. After
+    `free_failures` consecutive failures each further attempt must wait
+    `base_delay * 2**n` seconds (capped at `max_delay`); a success clears the
+    record, as does `forget_after` seconds without an attempt.
+    """
+
+    def __init__(
+        self,
+        free_failures: int = 3,
+        base_delay: float = 1.0,
+        max_delay: float = 300.0,
+        forget_after: float = 900.0,
+        max_clients: int = 10_000,
+    ):
+        self.free_failures = free_failures
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.forget_after = forget_after
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._clients = OrderedDict()  # client -> [failures, not_before, last_seen, in_flight]
+        self.throttled = 0
+
+    def acquire(self, client: str):
+        """Start an attempt, or raise LoginThrottled."""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            rec = self._clients.get(client)
+            if rec is None:
+                rec = self._clients[client] = [0, 0.0, now, False]
+            self._clients.move_to_end(client)
+            rec[2] = now
+            if rec[3] or rec[1] > now:
+                self.throttled += 1
+                raise LoginThrottled(max(1, math.ceil(rec[1] - now)))
+            rec[3] = True
+
+    def release(self, client: str, ok):
+        """Finish an attempt started by acquire().
+
+        ok is True or False for a checked password, or None when the attempt
+        never reached the check (it is then not counted as a failure).
+        """
+        with self._lock:
+            rec = self._clients.get(client)
+            if rec is None:
+                return
+            rec[3] = False
+            if ok is None:
+                return
+            if ok:
+                del self._clients[client]
+                return
+            rec[0] += 1
+            over = rec[0] - self.free_failures
+            if over >= 0:
+                rec[1] = time.monotonic() + min(self.max_delay, self.base_delay * 2 ** over)
+
+    def _expire(self, now):
+        while self._clients:
+            client, rec = next(iter(self._clients.items()))
+            stale = now - rec[2] > self.forget_after and not rec[3]
+            if not stale and len(self._clients) < self.max_clients:
+                break
+            del self._clients[client]
+
+    def stats(self):
+        with self._lock:
+            return {"clients": len(self._clients), "throttled": self.throttled}
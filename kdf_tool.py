@@ -0,0 +1,70 @@
+"""Inspect, calibrate and upgrade the vault's key-derivation parameters.
+
+Usage:
+    python kdf_tool.py show
+    python kdf_tool.py calibrate --target-ms 500
+    python kdf_tool.py upgrade --target-ms 500
+    python kdf_tool.py upgrade --iterations 600000
+"""
+import argparse
+import getpass
+import time
+
+from db_handler import (
+    KDF_ALGORITHM,
+    calibrate_kdf_iterations,
+    check_master_password,
+    get_pool,
+    load_kdf_params,
+    upgrade_kdf,
+)
+
+
+def show(args):
+    params = load_kdf_params(get_pool().connection())
+    print(f"{KDF_ALGORITHM}: {params['iterations']} iterations, dklen {params['dklen']}")
+    if args.time:
+        start = time.perf_counter()
+        ok, _ = check_master_password(getpass.getpass("Master password: "))
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f"Unlock {'succeeded' if ok else 'failed'} in {elapsed:.0f} ms")
+
+
+def calibrate(args):
+    iterations = calibrate_kdf_iterations(args.target_ms / 1000)
+    print(f"{iterations} iterations take about {args.target_ms:.0f} ms on this host")
+
+
+def upgrade(args):
+    if args.iterations is None and args.target_ms is None:
+        raise SystemExit("Give --iterations or --target-ms")
+    target = args.target_ms / 1000 if args.target_ms is not None else None
+    cipher = upgrade_kdf(
+        getpass.getpass("Master password: "), iterations=args.iterations, target_seconds=target
+    )
+    if cipher is None:
+        raise SystemExit("Incorrect password")
+    params = load_kdf_params(get_pool().connection())
+    print(f"Vault re-keyed with {params['iterations']} iterations")
+    print("Log in again in the web dashboard and the browser extension.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="action", required=True)
+    p = sub.add_parser("show", help="print the vault's KDF parameters")
+    p.add_argument("--time", action="store_true", help="also time an unlock")
+    p.set_defaults(func=show)
+    p = sub.add_parser("calibrate", help="iterations for a target unlock time")
+    p.add_argument("--target-ms", type=float, default=500)
+    p.set_defaults(func=calibrate)
+    p = sub.add_parser("upgrade", help="re-derive the key and re-encrypt the vault")
+    p.add_argument("--iterations", type=int)
+    p.add_argument("--target-ms", type=float)
+    p.set_defaults(func=upgrade)
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""Load test for the web app against a synthetic vault.
+
+Builds a throwaway vault with the requested number of credentials, then runs
+concurrent clients against the login, entries, add and dashboard endpoints,
+either in-process through the Flask test client or over HTTP against a local
+waitress server, and reports throughput and latency percentiles per endpoint.
+
+Over HTTP every worker connects from 127.0.0.1, so concurrent logins share
+one per-client throttle; refused logins are retried after Retry-After and
+show up as 429s in the report.
+
+Usage:
+    python load_test.py --credentials 1000 --clients 10 --duration 10
+    python load_test.py --credentials 100000 --clients 50 --server waitress
+    python load_test.py --mix entries=8,add=1,dashboard=1 --page-size 0
+"""
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+PASSWORD = "load-test-password"
+ENDPOINTS = ("login", "entries", "add", "dashboard")
+
+
+def _credential(rng, i):
+    return {
+        "site": f"https://{rng.choice(('www.', 'app.', ''))}site{i % 5000}.example.com/login",
+        "username": f"user{i}",
+        "email": f"user{i}@example.com",
+        "password": os.urandom(12).hex(),
+        "notes": rng.choice(("", "", "work account", "shared with team")),
+        "custom": {},
+    }
+
+
+def build_vault(credentials, folders, kdf_iterations, seed=0):
+    """Create vault.db in the current directory; returns seconds taken."""
+    from db_handler import DatabaseManager, setup_new_vault
+
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    db = DatabaseManager(setup_new_vault(PASSWORD, iterations=kdf_iterations))
+    per_folder = -(-credentials // folders) if credentials else 0
+    made = 0
+    for f in range(folders):
+        fid = db.add_folder(f"Folder {f + 1}")
+        count = min(per_folder, credentials - made)
+        db.add_blocks(fid, [("Credential", _credential(rng, made + i)) for i in range(count)])
+        made += count
+    return time.perf_counter() - start
+
+
+class _InProcessClient:
+    def __init__(self, app, worker):
+        self._client = app.test_client()
+        # Distinct addresses so the per-client login limiter sees separate clients
+        self._environ = {"REMOTE_ADDR": f"10.77.{worker // 256}.{worker % 256}"}
+
+    def request(self, method, path, body=None, headers=None):
+        resp = self._client.open(
+            path, method=method, json=body, headers=headers or {}, environ_base=self._environ
+        )
+        try:
+            return resp.status_code, resp.headers, resp.get_data()
+        finally:
+            resp.close()
+
+
+class _HttpClient:
+    def __init__(self, host, port):
+        self._conn = http.client.HTTPConnection(host, port, timeout=60)
+        self._cookie = None
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        if body is not None:
+            body = json.dumps(body)
+            headers["Content-Type"] = "application/json"
+        if self._cookie:
+            headers["Cookie"] = self._cookie
+        self._conn.request(method, path, body=body, headers=headers)
+        resp = self._conn.getresponse()
+        data = resp.read()
+        cookie = resp.getheader("Set-Cookie")
+        if cookie:
+            self._cookie = cookie.split(";", 1)[0]
+        return resp.status, dict(resp.getheaders()), data
+
+    def close(self):
+        self._conn.close()
+
+
+class Worker(threading.Thread):
+    def __init__(self, client, mix, page_size, deadline, seed):
+        super().__init__(daemon=True)
+        self.client = client
+        self.mix = mix
+        self.page_size = page_size
+        self.deadline = deadline
+        self.rng = random.Random(seed)
+        self.samples = []  # (endpoint, seconds, status)
+        self.key = None
+
+    def _timed(self, endpoint, method, path, body=None, headers=None):
+        start = time.perf_counter()
+        status, resp_headers, data = self.client.request(method, path, body, headers)
+        self.samples.append((endpoint, time.perf_counter() - start, status))
+        return status, resp_headers, data
+
+    def login(self):
+        while time.perf_counter() < self.deadline:
+            status, headers, data = self._timed(
+                "login", "POST", "/api/login", {"password": PASSWORD}
+            )
+            if status == 200:
+                self.key = json.loads(data)["key"]
+                return True
+            if status not in (429, 503):
+                return False
+            time.sleep(float(headers.get("Retry-After") or 1))
+        return False
+
+    def run(self):
+        if not self.login():
+            return
+        names, weights = zip(*self.mix.items())
+        auth = {"X-Vault-Key": self.key}
+        entries = "/api/entries" + (f"?limit={self.page_size}" if self.page_size else "")
+        n = 0
+        while time.perf_counter() < self.deadline:
+            op = self.rng.choices(names, weights)[0]
+            if op == "login":
+                self.login()
+            elif op == "entries":
+                self._timed("entries", "GET", entries, headers=auth)
+            elif op == "add":
+                n += 1
+                body = {"site": f"load{n}.example.net", "username": "load", "password": "x" * 16}
+                self._timed("add", "POST", "/api/add", body, auth)
+            else:
+                self._timed("dashboard", "GET", "/dashboard")
+
+
+def _percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    # Nearest-rank percentile
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def report(samples, elapsed):
+    by_endpoint = defaultdict(list)
+    errors = defaultdict(int)
+    statuses = defaultdict(lambda: defaultdict(int))
+    for endpoint, seconds, status in samples:
+        by_endpoint[endpoint].append(seconds)
+        statuses[endpoint][status] += 1
+        if status >= 400:
+            errors[endpoint] += 1
+    print(f"{'endpoint':<11}{'requests':>9}{'errors':>8}{'req/s':>9}"
+          f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}  statuses")
+    for endpoint in ENDPOINTS + ("total",):
+        values = sorted(s for e, s, _ in samples) if endpoint == "total" else sorted(
+            by_endpoint.get(endpoint, ()))
+        if not values:
+            continue
+        errs = sum(errors.values()) if endpoint == "total" else errors[endpoint]
+        codes = "" if endpoint == "total" else " ".join(
+            f"{code}x{count}" for code, count in sorted(statuses[endpoint].items()))
+        print(f"{endpoint:<11}{len(values):>9}{errs:>8}{len(values) / elapsed:>9.1f}"
+              + "".join(f"{_percentile(values, p) * 1000:>9.1f}" for p in (50, 95, 99))
+              + f"{values[-1] * 1000:>9.1f}  {codes}")
+
+
+def _parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"unknown endpoint {name!r}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--credentials", type=int, default=1000)
+    parser.add_argument("--folders", type=int, default=10)
+    parser.add_argument("--clients", type=int, default=10, help="concurrent workers")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of load")
+    parser.add_argument("--mix", type=_parse_mix,
+                        default=_parse_mix("login=1,entries=14,add=2,dashboard=3"),
+                        help="endpoint weights, e.g. entries=8,add=1")
+    parser.add_argument("--page-size", type=int, default=100,
+                        help="/api/entries limit; 0 lists every credential")
+    parser.add_argument("--server", choices=("inprocess", "waitress"), default="inprocess")
+    parser.add_argument("--threads", type=int, help="waitress threads (default: clients + 4)")
+    parser.add_argument("--kdf-iterations", type=int, default=100_000)
+    parser.add_argument("--keep", action="store_true", help="keep the generated vault")
+    args = parser.parse_args()
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, here)
+    tmp = tempfile.mkdtemp(prefix="nv-load-")
+    cwd = os.getcwd()
+    # web_app and db_handler use vault.db and app.log in the working directory
+    os.chdir(tmp)
+    server = None
+    clients = []
+    try:
+        took = build_vault(args.credentials, args.folders, args.kdf_iterations)
+        print(f"Vault with {args.credentials} credentials in {args.folders} folders "
+              f"built in {took:.1f}s ({tmp})")
+        import web_app
+
+        if args.server == "waitress":
+            from waitress.server import create_server
+
+            server = create_server(web_app.app, host="127.0.0.1", port=0,
+                                   threads=args.threads or args.clients + 4)
+            threading.Thread(target=server.run, daemon=True).start()
+            clients = [_HttpClient("127.0.0.1", server.effective_port)
+                       for _ in range(args.clients)]
+        else:
+            clients = [_InProcessClient(web_app.app, i) for i in range(args.clients)]
+
+        deadline = time.perf_counter() + args.duration
+        workers = [Worker(c, args.mix, args.page_size, deadline, seed=i)
+                   for i, c in enumerate(clients)]
+        start = time.perf_counter()
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        elapsed = time.perf_counter() - start
+        print(f"{args.clients} clients for {elapsed:.1f}s via {args.server}")
+        report([s for w in workers for s in w.samples], elapsed)
+    finally:
+        for client in clients:
+            if isinstance(client, _HttpClient):
+                client.close()
+        if server is not None:
+            server.close()
+        os.chdir(cwd)
+        if not args.keep:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
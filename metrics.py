@@ -0,0 +1,189 @@
+"""Request metrics for the web app in the Prometheus text exposition format.
+
+init_app() times every request by route template, tallies the SQL statements
+and decryptions it caused (from db_handler.op_counters) and serves the totals
+at /metrics. Set METRICS_SERVER_TIMING=1 to also report them per response in
+a Server-Timing header, and METRICS_TOKEN to require
+`Authorization: Bearer <token>` on /metrics.
+"""
+import bisect
+import hmac
+import os
+import threading
+import time
+
+from flask import Response, g, request
+
+from db_handler import op_counters
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 1000, 10_000)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    pairs = (f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+    return "{" + ",".join(pairs) + "}" if names else ""
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            yield self.name + _labels(self.labels, labels), value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [per-bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(labels)
+            if row is None:
+                row = self._values[labels] = [0] * (len(self.buckets) + 2)
+            row[i] += 1
+            row[-1] += value
+
+    def samples(self):
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        names = self.labels + ("le",)
+        for labels, row in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), row):
+                cumulative += count
+                yield self.name + "_bucket" + _labels(names, labels + (bound,)), cumulative
+            yield self.name + "_sum" + _labels(self.labels, labels), row[-1]
+            yield self.name + "_count" + _labels(self.labels, labels), cumulative
+
+
+class Callback:
+    """A gauge or counter whose value is read from fn() at scrape time.
+
+    fn returns a number, or a dict of label-value tuples to numbers.
+    """
+
+    def __init__(self, name, help, fn, labels=(), kind="gauge"):
+        self.name, self.help, self.labels, self.fn = name, help, tuple(labels), fn
+        self.kind = kind
+
+    def samples(self):
+        value = self.fn()
+        if not isinstance(value, dict):
+            value = {(): value}
+        for labels, v in sorted(value.items()):
+            yield self.name + _labels(self.labels, labels), v
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for m in self._metrics:
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            for name, value in m.samples():
+                lines.append(f"{name} {value:g}" if isinstance(value, float) else f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+REQUEST_LABELS = ("route", "method")
+requests_total = registry.add(Counter(
+    "notionvault_http_requests_total", "HTTP requests handled",
+    ("route", "method", "status")))
+request_seconds = registry.add(Histogram(
+    "notionvault_http_request_duration_seconds",
+    "Time from request start until the response body was sent", REQUEST_LABELS))
+sql_per_request = registry.add(Histogram(
+    "notionvault_sql_statements_per_request", "SQL statements executed per request",
+    REQUEST_LABELS, COUNT_BUCKETS))
+decrypted_rows = registry.add(Counter(
+    "notionvault_decrypted_rows_total", "Ciphertexts decrypted", REQUEST_LABELS))
+decrypted_bytes = registry.add(Counter(
+    "notionvault_decrypted_bytes_total", "Ciphertext bytes decrypted", REQUEST_LABELS))
+
+
+def _route():
+    rule = request.url_rule
+    return rule.rule if rule is not None else "<unmatched>"
+
+
+def _before():
+    g._metrics_start = (time.perf_counter(), op_counters.snapshot())
+
+
+def _after(response):
+    started = g.pop("_metrics_start", None)
+    if started is None:
+        return response
+    start, counts = started
+    route, method, status = _route(), request.method, response.status_code
+
+    def delta():
+        return [b - a for a, b in zip(counts, op_counters.snapshot())]
+
+    if os.environ.get("METRICS_SERVER_TIMING") == "1":
+        sql, rows, nbytes = delta()
+        elapsed = (time.perf_counter() - start) * 1000
+        response.headers["Server-Timing"] = (
+            f"app;dur={elapsed:.1f}, sql;desc=\"{sql} statements\", "
+            f"decrypt;desc=\"{rows} rows, {nbytes} bytes\""
+        )
+
+    def record():
+        # Runs once the body has been sent, so streamed responses are
+        # measured in full. Counters are per thread, and the server sends the
+        # body on the thread that ran the view.
+        sql, rows, nbytes = delta()
+        requests_total.inc(route, method, str(status))
+        request_seconds.observe(time.perf_counter() - start, route, method)
+        sql_per_request.observe(sql, route, method)
+        decrypted_rows.inc(route, method, amount=rows)
+        decrypted_bytes.inc(route, method, amount=nbytes)
+
+    response.call_on_close(record)
+    return response
+
+
+def _serve_metrics():
+    token = os.environ.get("METRICS_TOKEN")
+    if token and not hmac.compare_digest(
+        request.headers.get("Authorization", ""), f"Bearer {token}"
+    ):
+        return Response("Unauthorized\n", 401, mimetype="text/plain")
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+
+def init_app(app, path="/metrics"):
+    app.before_request(_before)
+    app.after_request(_after)
+    app.add_url_rule(path, "metrics", _serve_metrics)
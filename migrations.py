@@ -0,0 +1,190 @@
+"""Versioned schema migrations for vault.db.
+
+The applied version is kept in meta.schema_version. Each migration runs in
+its own write transaction and re-checks the version inside it, so several
+processes opening the same vault migrate it exactly once.
+
+Usage:
+    python migrations.py [path/to/vault.db]
+"""
+import logging
+import sqlite3
+import sys
+import time
+
+MIGRATIONS = []
+
+
+def migration(version: int, name: str):
+    def register(fn):
+        MIGRATIONS.append((version, name, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return register
+
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+@migration(1, "base tables")
+def _base_tables(conn):
+    c = conn.cursor()
+    # Meta for master password
+    c.execute("""CREATE TABLE IF NOT EXISTS meta (k TEXT PRIMARY KEY, v TEXT)""")
+    # Folders
+    c.execute("""CREATE TABLE IF NOT EXISTS folders (
+                   id INTEGER PRIMARY KEY AUTOINCREMENT,
+                   name TEXT NOT NULL,
+                   sort INTEGER DEFAULT 0
+                 )""")
+    # Blocks
+    c.execute("""CREATE TABLE IF NOT EXISTS blocks (
+                   id INTEGER PRIMARY KEY AUTOINCREMENT,
+                   folder_id INTEGER NOT NULL,
+                   type TEXT NOT NULL,
+                   content TEXT NOT NULL,
+                   sort INTEGER DEFAULT 0,
+                   FOREIGN KEY(folder_id) REFERENCES folders(id) ON DELETE CASCADE
+                 )""")
+    # Keyed search tokens, maintained only while meta.blind_index is '1'
+    c.execute("""CREATE TABLE IF NOT EXISTS block_terms (
+                   term BLOB NOT NULL,
+                   block_id INTEGER NOT NULL,
+                   PRIMARY KEY(term, block_id),
+                   FOREIGN KEY(block_id) REFERENCES blocks(id) ON DELETE CASCADE
+                 ) WITHOUT ROWID""")
+    c.execute(
+        "CREATE INDEX IF NOT EXISTS idx_block_terms_block ON block_terms(block_id)"
+    )
+    # Ordering lookups: MAX(sort) on insert and neighbour searches on move
+    c.execute("CREATE INDEX IF NOT EXISTS idx_folders_sort ON folders(sort)")
+    c.execute(
+        "CREATE INDEX IF NOT EXISTS idx_blocks_folder_sort ON blocks(folder_id, sort)"
+    )
+
+
+@migration(2, "index blocks by type")
+def _type_index(conn):
+    # (type, rowid) lets credential listings walk only Credential rows in id order
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_blocks_type ON blocks(type)")
+
+
+@migration(3, "block updated_at and size columns")
+def _block_metadata(conn):
+    cols = _columns(conn, "blocks")
+    if "updated_at" not in cols:
+        conn.execute("ALTER TABLE blocks ADD COLUMN updated_at REAL")
+    if "size" not in cols:
+        conn.execute("ALTER TABLE blocks ADD COLUMN size INTEGER")
+    conn.execute(
+        "UPDATE blocks SET size = length(content), updated_at = ? WHERE size IS NULL",
+        (time.time(),),
+    )
+
+
+@migration(4, "remove orphaned rows")
+def _remove_orphans(conn):
+    # Foreign keys were never enabled before this version, so deleted
+    # folders left their blocks (and those blocks' terms) behind
+    conn.execute("DELETE FROM blocks WHERE folder_id NOT IN (SELECT id FROM folders)")
+    conn.execute("DELETE FROM block_terms WHERE block_id NOT IN (SELECT id FROM blocks)")
+
+
+@migration(5, "vault revision counter")
+def _revision_counter(conn):
+    conn.execute("INSERT OR IGNORE INTO meta (k,v) VALUES ('revision','0')")
+
+
+@migration(6, "block change log")
+def _change_log(conn):
+    conn.execute("""CREATE TABLE IF NOT EXISTS changes (
+                      id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      block_id INTEGER NOT NULL,
+                      op TEXT NOT NULL,
+                      revision INTEGER NOT NULL,
+                      ts REAL NOT NULL
+                    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_changes_revision ON changes(revision)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_changes_block ON changes(block_id)")
+    # Nothing before the current revision was logged
+    conn.execute(
+        """INSERT OR IGNORE INTO meta (k,v)
+           SELECT 'changes_floor', v FROM meta WHERE k='revision'"""
+    )
+
+
+@migration(7, "folder revisions")
+def _folder_revisions(conn):
+    if "rev" not in _columns(conn, "folders"):
+        conn.execute("ALTER TABLE folders ADD COLUMN rev INTEGER NOT NULL DEFAULT 0")
+    # Any write to a block, from any code path, invalidates its folder's
+    # rendered views; moves touch both folders
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS blocks_touch_folder_insert
+                    AFTER INSERT ON blocks BEGIN
+                      UPDATE folders SET rev = rev + 1 WHERE id = NEW.folder_id;
+                    END""")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS blocks_touch_folder_update
+                    AFTER UPDATE ON blocks BEGIN
+                      UPDATE folders SET rev = rev + 1
+                      WHERE id IN (OLD.folder_id, NEW.folder_id);
+                    END""")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS blocks_touch_folder_delete
+                    AFTER DELETE ON blocks BEGIN
+                      UPDATE folders SET rev = rev + 1 WHERE id = OLD.folder_id;
+                    END""")
+
+
+def configure(conn):
+    """Per-connection pragmas; these are not stored in the database file."""
+    conn.execute("PRAGMA foreign_keys=ON")
+
+
+def current_version(conn) -> int:
+    try:
+        row = conn.execute("SELECT v FROM meta WHERE k='schema_version'").fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return int(row[0]) if row else 0
+
+
+def migrate(conn):
+    """Bring the schema up to date; returns [(version, name, seconds)] applied."""
+    report = []
+    for version, name, fn in MIGRATIONS:
+        if current_version(conn) >= version:
+            continue
+        start = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if current_version(conn) >= version:
+                conn.rollback()
+                continue
+            fn(conn)
+            conn.execute(
+                "INSERT OR REPLACE INTO meta (k,v) VALUES ('schema_version',?)",
+                (str(version),),
+            )
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        elapsed = time.perf_counter() - start
+        logging.info(f"Migration {version} ({name}) applied in {elapsed * 1000:.1f} ms")
+        report.append((version, name, elapsed))
+    return report
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else "vault.db"
+    conn = sqlite3.connect(path)
+    configure(conn)
+    print(f"{path}: schema version {current_version(conn)}")
+    report = migrate(conn)
+    for version, name, elapsed in report:
+        print(f"  {version:>3}  {name:<40}{elapsed * 1000:>10.1f} ms")
+    print(f"Now at version {current_version(conn)}" if report else "Already up to date")
+
+
+if __name__ == "__main__":
+    main()
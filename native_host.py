@@ -2,110 +2,478 @@ import sys
 import json
 import struct
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 # Ensure we can import modules from the current directory
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from db_handler import DatabaseManager, check_master_password, SimpleCipher
+import blind_index
+from db_handler import DatabaseManager, check_master_password, SimpleCipher, add_commit_listener, get_pool
+from host_index import HostIndex
+from read_model import ReadModel
 
 import logging
 logging.basicConfig(filename='native_host.log', level=logging.DEBUG)
 
+# Seconds an unlocked session may sit unused before it is wiped
+SESSION_IDLE_SECONDS = float(os.environ.get('NATIVE_SESSION_IDLE', 300))
+# Chrome disconnects a host that sends it a message larger than 1 MB
+MAX_MESSAGE_BYTES = 1024 * 1024
+# Streamed fetch responses are cut into frames of at most this many bytes
+CHUNK_BYTES = 256 * 1024
+# Threads running fetch/lookup/add/changes, and threads deriving keys for login
+NATIVE_WORKERS = int(os.environ.get('NATIVE_WORKERS', 4))
+NATIVE_KDF_WORKERS = int(os.environ.get('NATIVE_KDF_WORKERS', 1))
+
+
+class Session:
+    """An unlocked vault kept open between messages for one key.
+
+    Holds the cipher and a read model of the decrypted vault, so repeat
+    fetches answer from memory. The model is rebuilt only after a write or
+    when vault.db changes on disk (e.g. the desktop app saved), and then
+    only changed rows are decrypted again. A hostname index over the
+    credentials answers origin lookups and follows the same snapshots.
+    """
+
+    def __init__(self, key_hex):
+        self.cipher = SimpleCipher(key=bytes.fromhex(key_hex))
+        self.pool = get_pool()
+        self.model = ReadModel(self.cipher, self.pool.path)
+        self.last_used = time.monotonic()
+        self._local = threading.local()
+        self._hosts = HostIndex()
+        self._indexed = None  # snapshot the host index was synced to
+        self._hosts_lock = threading.Lock()
+
+    def db(self):
+        """DatabaseManager on this thread's pooled connection."""
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = DatabaseManager(self.cipher, pool=self.pool)
+        return db
+
+    def snapshot(self):
+        """Current decrypted snapshot, or None if the key no longer opens the vault."""
+        return self.model.snapshot()
+
+    def opens_vault(self):
+        return self.db().opens_vault()
+
+    def lookup(self, origin):
+        """[(bid, data)] of credentials matching a page origin, or None for a bad key."""
+        with self._hosts_lock:
+            snap = self._sync_hosts()
+            if snap is None:
+                return None
+            return self._hosts.lookup(origin)
+
+    def refresh(self):
+        """Bring the snapshot and host index up to date, e.g. right after a write."""
+        with self._hosts_lock:
+            return self._sync_hosts()
+
+    def _sync_hosts(self):
+        snap = self.snapshot()
+        if snap is not None and snap is not self._indexed:
+            self._hosts.sync((bid, data) for bid, _, data in snap.iter_credentials())
+            self._indexed = snap
+        return snap
+
+    def wipe(self):
+        self.model.wipe()
+        with self._hosts_lock:
+            self._hosts = HostIndex()
+            self._indexed = None
+
+
+_sessions = {}  # key hex -> Session
+_sessions_lock = threading.Lock()
+
+
+def get_session(key_hex):
+    with _sessions_lock:
+        session = _sessions.get(key_hex)
+        if session is None:
+            session = _sessions[key_hex] = Session(key_hex)
+        session.last_used = time.monotonic()
+        return session
+
+
+def drop_session(key_hex):
+    with _sessions_lock:
+        session = _sessions.pop(key_hex, None)
+    if session is not None:
+        session.wipe()
+
+
+def expire_sessions(now=None):
+    """Wipe sessions idle for longer than SESSION_IDLE_SECONDS."""
+    now = time.monotonic() if now is None else now
+    with _sessions_lock:
+        idle = [k for k, s in _sessions.items() if now - s.last_used > SESSION_IDLE_SECONDS]
+        expired = [_sessions.pop(k) for k in idle]
+    for session in expired:
+        session.wipe()
+    if expired:
+        logging.debug(f"Wiped {len(expired)} idle session(s)")
+
+
+def _reap_sessions():
+    while True:
+        time.sleep(max(1.0, min(SESSION_IDLE_SECONDS / 4, 30.0)))
+        expire_sessions()
+
+
+def _on_commit(path):
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+    for session in sessions:
+        if session.pool.path == path:
+            session.model.invalidate()
+
+
+add_commit_listener(_on_commit)
+
+
+def _entry(bid, blk_data):
+    return {
+        'id': bid,
+        'site': blk_data.get('site'),
+        'username': blk_data.get('username'),
+        'password': blk_data.get('password')
+    }
+
+class Channel:
+    """Length-prefixed JSON frames to one reader: Chrome, or a daemon client.
+
+    Replies are written from several worker threads, so each frame is
+    written under a lock and frames never interleave.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._lock = threading.Lock()
+
+    def write_frame(self, encoded):
+        """Write one length-prefixed, already encoded message."""
+        with self._lock:
+            self.stream.write(struct.pack('I', len(encoded)))
+            self.stream.write(encoded)
+            self.stream.flush()
+
+    def send(self, message, streamable=False):
+        """Send a JSON message.
+
+        A reply over MAX_MESSAGE_BYTES is replaced by an error; streamable
+        says whether the command could have sent it as frames instead.
+        """
+        logging.debug(f"Sending: {message}")
+        encoded_message = json.dumps(message).encode('utf-8')
+        if len(encoded_message) > MAX_MESSAGE_BYTES:
+            # Chrome would drop the connection instead of delivering it
+            logging.debug(f"Response of {len(encoded_message)} bytes is too large")
+            error = 'Response too large'
+            if streamable:
+                error += ', request it with "stream": true'
+            encoded_message = json.dumps({
+                'id': message.get('id'), 'error': error
+            }).encode('utf-8')
+        self.write_frame(encoded_message)
+
+stdout = Channel(sys.stdout.buffer)
+
+def write_frame(encoded):
+    """Write one length-prefixed, already encoded message to Chrome."""
+    stdout.write_frame(encoded)
+
 def send_message(message):
     """Send a JSON message to Chrome."""
-    logging.debug(f"Sending: {message}")
-    encoded_message = json.dumps(message).encode('utf-8')
-    sys.stdout.buffer.write(struct.pack('I', len(encoded_message)))
-    sys.stdout.buffer.write(encoded_message)
-    sys.stdout.buffer.flush()
-
-def read_message():
-    """Read a JSON message from Chrome."""
-    print("Reading...", file=sys.stderr) # Debug log to stderr
-    raw_length = sys.stdin.buffer.read(4)
-    if not raw_length:
-        sys.exit(0)
+    stdout.send(message)
+
+def send_stream(msg_id, items, write=write_frame, field='entries', **fields):
+    """Send items as a series of frames as they are produced.
+
+    Each frame is {"id", "seq", <field>, "done"} plus any extra fields, and
+    holds at most CHUNK_BYTES of items; the last one has done=true, and an
+    error part-way through ends the stream with an "error" frame.
+    Returns the number of frames sent.
+    """
+    head = json.dumps({'id': msg_id, **fields})[:-1].encode('utf-8')
+    opening = f', {json.dumps(field)}: ['.encode('utf-8')
+    seq, batch, size = 0, [], 0
+
+    def flush(done, error=None):
+        tail = f'"seq": {seq}, "done": {json.dumps(done)}'
+        if error is not None:
+            tail += f', "error": {json.dumps(error)}'
+        write(head + opening + b', '.join(batch) + b'], ' + tail.encode('utf-8') + b'}')
+
+    try:
+        for item in items:
+            encoded = json.dumps(item).encode('utf-8')
+            if batch and size + len(encoded) > CHUNK_BYTES:
+                flush(False)
+                seq, batch, size = seq + 1, [], 0
+            batch.append(encoded)
+            size += len(encoded) + 2
+    except Exception as e:
+        flush(True, str(e))
+        return seq + 1
+    flush(True)
+    return seq + 1
+
+def read_frame(stream):
+    """Read one JSON message from a binary stream; None at end of input."""
+    raw_length = stream.read(4)
+    if len(raw_length) < 4:
+        return None
     message_length = struct.unpack('I', raw_length)[0]
-    message = sys.stdin.buffer.read(message_length).decode('utf-8')
-    return json.loads(message)
+    message = stream.read(message_length)
+    if len(message) < message_length:
+        return None
+    return json.loads(message.decode('utf-8'))
 
-def handle_login(data):
+def handle_login(data, channel=None):
     pwd = data.get('password')
     ok, cipher = check_master_password(pwd)
     if ok:
-        return {'success': True, 'key': cipher.key.hex()}
+        key_hex = cipher.key.hex()
+        # Decrypt and index the vault now so the first lookup answers from memory
+        get_session(key_hex).refresh()
+        return {'success': True, 'key': key_hex}
     return {'success': False, 'error': 'Invalid Password'}
 
-def handle_fetch(data):
+def _credentials(session, query=None, site=None):
+    """(id, folder, data) of credentials from the snapshot, filtered in memory."""
+    snap = session.snapshot()
+    if snap is None:
+        return None
+    rows = snap.iter_credentials()
+    if query or site:
+        all_of, any_of = blind_index.query_terms(query, site)
+        rows = (
+            (bid, fname, blk_data) for bid, fname, blk_data in rows
+            if blind_index.matches(
+                blind_index.plain_terms('Credential', blk_data), all_of, any_of
+            )
+        )
+    return rows
+
+def handle_fetch(data, channel=None):
     key_hex = data.get('key')
     if not key_hex:
         return {'error': 'No key provided'}
     
     try:
-        cipher = SimpleCipher(key=bytes.fromhex(key_hex))
-        db = DatabaseManager(cipher)
-        folders = db.fetch_folders()
-        entries = []
-        for fid, fname in folders:
-             blocks = db.fetch_blocks(fid)
-             for bid, btype, blk_data in blocks:
-                 if btype == 'Credential':
-                     entries.append({
-                         'id': bid,
-                         'site': blk_data.get('site'),
-                         'username': blk_data.get('username'),
-                         'password': blk_data.get('password')
-                     })
-        return {'entries': entries}
+        session = get_session(key_hex)
+        query = data.get('query')
+        site = data.get('site')
+        if data.get('stream') and session.model.peek() is None:
+            # Cold session: stream rows as they are decrypted rather than
+            # waiting for the whole snapshot before the first frame
+            if not session.opens_vault():
+                drop_session(key_hex)
+                return {'error': 'Invalid key'}
+            db = session.db()
+            rows = db.search_credentials(query, site) if query or site else db.iter_credentials()
+        else:
+            rows = _credentials(session, query, site)
+            if rows is None:
+                drop_session(key_hex)
+                return {'error': 'Invalid key'}
+        entries = (_entry(bid, blk_data) for bid, _, blk_data in rows)
+        if data.get('stream'):
+            send_stream(data.get('id'), entries, write=(channel or stdout).write_frame)
+            # Build the snapshot after the fact so later requests are warm
+            session.refresh()
+            return None
+        return {'entries': list(entries)}
+    except Exception as e:
+        return {'error': str(e)}
+
+def handle_lookup(data, channel=None):
+    key_hex = data.get('key')
+    origin = data.get('origin')
+    if not key_hex or not origin:
+        return {'error': 'Missing data'}
+
+    try:
+        session = get_session(key_hex)
+        rows = session.lookup(origin)
+        if rows is None:
+            drop_session(key_hex)
+            return {'error': 'Invalid key'}
+        entries = (_entry(bid, blk_data) for bid, blk_data in rows)
+        if data.get('stream'):
+            send_stream(data.get('id'), entries, write=(channel or stdout).write_frame)
+            return None
+        return {'entries': list(entries)}
+    except Exception as e:
+        return {'error': str(e)}
+
+def handle_changes(data, channel=None):
+    key_hex = data.get('key')
+    since = data.get('since')
+    if not key_hex or since is None:
+        return {'error': 'Missing data'}
+
+    try:
+        session = get_session(key_hex)
+        if not session.opens_vault():
+            drop_session(key_hex)
+            return {'error': 'Invalid key'}
+        revision, reset, rows = session.db().changes_since(int(since))
+        changes = (
+            {'op': 'delete', 'id': bid} if op == 'delete'
+            else {'op': 'upsert', 'entry': _entry(bid, blk_data)}
+            for op, bid, _, blk_data in rows
+        )
+        if data.get('stream'):
+            send_stream(data.get('id'), changes, write=(channel or stdout).write_frame,
+                        field='changes', revision=revision, reset=reset)
+            return None
+        return {'revision': revision, 'reset': reset, 'changes': list(changes)}
     except Exception as e:
         return {'error': str(e)}
 
-def handle_add(data):
+# Keeps concurrent adds from each creating the 'Extension' folder
+_add_lock = threading.Lock()
+
+def handle_add(data, channel=None):
     key_hex = data.get('key')
     entry = data.get('entry')
     if not key_hex or not entry:
         return {'error': 'Missing data'}
     
     try:
-        cipher = SimpleCipher(key=bytes.fromhex(key_hex))
-        db = DatabaseManager(cipher)
-        
-        # We'll add to 'Default' folder for simplicity or create if not exists
-        folders = db.fetch_folders()
-        default_folder_id = None
-        for fid, fname in folders:
-            if fname == 'Default' or fname == 'Extension':
-                default_folder_id = fid
-                break
-        
-        if default_folder_id is None:
-            default_folder_id = db.add_folder('Extension')
-
-        db.add_block(default_folder_id, 'Credential', entry)
-        return {'success': True}
+        with _add_lock:
+            return _add_entry(key_hex, entry)
     except Exception as e:
         return {'error': str(e)}
 
-def main():
-    while True:
+def _add_entry(key_hex, entry):
+    session = get_session(key_hex)
+    db = session.db()
+    snap = session.snapshot()
+    if snap is None:
+        drop_session(key_hex)
+        return {'error': 'Invalid key'}
+
+    # We'll add to 'Default' folder for simplicity or create if not exists
+    folders = snap.fetch_folders()
+    default_folder_id = None
+    for fid, fname in folders:
+        if fname == 'Default' or fname == 'Extension':
+            default_folder_id = fid
+            break
+    
+    if default_folder_id is None:
+        default_folder_id = db.add_folder('Extension')
+
+    db.add_block(default_folder_id, 'Credential', entry)
+    # Index the new entry now rather than on the next lookup
+    session.refresh()
+    return {'success': True}
+
+HANDLERS = {
+    'login': handle_login,
+    'fetch': handle_fetch,
+    'lookup': handle_lookup,
+    'add': handle_add,
+    'changes': handle_changes,
+}
+
+# Commands that send their reply as frames when asked with "stream": true
+STREAMED_COMMANDS = {'fetch', 'lookup', 'changes'}
+
+def dispatch(msg, channel=stdout):
+    """Run one command on a worker thread and send its reply."""
+    try:
+        handler = HANDLERS.get(msg.get('command'))
+        resp = handler(msg, channel) if handler else {'error': 'Unknown command'}
+        # Streamed responses have already been sent as frames
+        if resp is not None:
+            if 'id' in msg:
+                resp['id'] = msg['id']
+            channel.send(resp, streamable=msg.get('command') in STREAMED_COMMANDS)
+    except Exception as e:
+        logging.exception(f"{msg.get('command')} failed")
         try:
-            msg = read_message()
-            cmd = msg.get('command')
-            
-            if cmd == 'login':
-                resp = handle_login(msg)
-            elif cmd == 'fetch':
-                resp = handle_fetch(msg)
-            elif cmd == 'add':
-                resp = handle_add(msg)
-            elif cmd == 'ping':
-                resp = {'pong': True}
-            else:
-                resp = {'error': 'Unknown command'}
-            
-            send_message(resp)
-        except Exception as e:
-            send_message({'error': str(e)})
+            channel.send({'id': msg.get('id'), 'error': str(e)})
+        except Exception:
+            pass
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+def _executor(name, workers):
+    """Thread pool shared by every client of this process."""
+    with _executors_lock:
+        pool = _executors.get(name)
+        if pool is None:
+            pool = _executors[name] = ThreadPoolExecutor(workers, thread_name_prefix=name)
+        return pool
+
+_reaper_started = threading.Event()
+
+def start_reaper():
+    if not _reaper_started.is_set():
+        _reaper_started.set()
+        threading.Thread(target=_reap_sessions, name='session-reaper', daemon=True).start()
+
+def serve(stream, channel):
+    """Read messages from stream until it ends, answering them on channel.
+
+    This thread only reads and answers ping. Logins run on their own KDF
+    threads, so a slow key derivation never holds up a lookup, and
+    everything else runs on NATIVE_WORKERS threads. Replies to messages
+    with an "id" may come back in any order; messages without one are run
+    one at a time, in order, as before. Returns once every reply is sent.
+    """
+    workers = _executor('native', NATIVE_WORKERS)
+    kdf = _executor('native-kdf', NATIVE_KDF_WORKERS)
+    ordered = ThreadPoolExecutor(1, thread_name_prefix='native-ordered')
+    pending = []
+    try:
+        while True:
+            msg = {}
+            try:
+                msg = read_frame(stream)
+                if msg is None:
+                    return
+                if not isinstance(msg, dict):
+                    msg = {}
+                    raise ValueError('Expected a JSON object')
+                cmd = msg.get('command')
+
+                if cmd == 'ping':
+                    resp = {'pong': True}
+                    if 'id' in msg:
+                        resp['id'] = msg['id']
+                    channel.send(resp)
+                    continue
+                if 'id' not in msg:
+                    pool = ordered
+                elif cmd == 'login':
+                    pool = kdf
+                else:
+                    pool = workers
+                pending = [f for f in pending if not f.done()]
+                pending.append(pool.submit(dispatch, msg, channel))
+            except ValueError as e:
+                # A bad message; the stream itself is still usable
+                channel.send({'id': msg.get('id'), 'error': str(e)})
+    finally:
+        ordered.shutdown(wait=True)
+        for future in pending:
+            future.exception()
+
+def main():
+    start_reaper()
+    serve(sys.stdin.buffer, stdout)
 
 if __name__ == '__main__':
     # Windows-specific: Ensure binary mode for stdin/stdout
@@ -0,0 +1,130 @@
+"""Native messaging host that relays Chrome's frames to vault_daemon.py.
+
+Chrome starts a host process for every sendNativeMessage call and for each
+connectNative port. This one imports nothing from the vault, so it starts
+quickly; it connects to the resident daemon and copies bytes both ways, so
+the daemon's open vault, sessions and indexes serve every message. If no
+daemon is running one is started, and if it still cannot be reached the
+messages are served in this process by native_host as before.
+
+Environment:
+    VAULT_DAEMON_AUTOSTART   set to 0 to never start the daemon from here
+"""
+import json
+import os
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# Written by the daemon next to vault.db: its address and a client token
+ADDRESS_FILE = 'vault_daemon.json'
+START_TIMEOUT = 5.0
+
+
+def connect(timeout=2.0):
+    """Socket connected and authenticated to the running daemon, or None."""
+    try:
+        with open(ADDRESS_FILE) as f:
+            address = json.load(f)
+        if 'unix' in address:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(timeout)
+            sock.connect(address['unix'])
+        else:
+            sock = socket.create_connection(tuple(address['tcp']), timeout)
+        hello = json.dumps({'token': address['token']}).encode('utf-8')
+        sock.settimeout(None)
+        sock.sendall(struct.pack('I', len(hello)) + hello)
+    except (OSError, ValueError, KeyError, AttributeError):
+        return None
+    return sock
+
+
+def start_daemon():
+    """Start vault_daemon.py detached from this process and from Chrome's pipes."""
+    kwargs = {}
+    if sys.platform == 'win32':
+        kwargs['creationflags'] = (
+            subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+        )
+    else:
+        kwargs['start_new_session'] = True
+    subprocess.Popen(
+        [sys.executable, os.path.join(HERE, 'vault_daemon.py')],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        close_fds=True,
+        **kwargs
+    )
+
+
+def connect_or_start():
+    sock = connect()
+    if sock is not None or os.environ.get('VAULT_DAEMON_AUTOSTART') == '0':
+        return sock
+    try:
+        start_daemon()
+    except OSError:
+        return None
+    deadline = time.monotonic() + START_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        sock = connect()
+        if sock is not None:
+            return sock
+    return None
+
+
+def relay(sock):
+    """Copy Chrome's stdin to the daemon and the daemon's replies to stdout."""
+    def downstream():
+        out = sys.stdout.buffer
+        try:
+            while True:
+                data = sock.recv(65536)
+                if not data:
+                    break
+                out.write(data)
+                out.flush()
+        except OSError:
+            pass
+
+    replies = threading.Thread(target=downstream)
+    replies.start()
+    stdin = sys.stdin.buffer
+    try:
+        while True:
+            data = stdin.read1(65536)
+            if not data:
+                break
+            sock.sendall(data)
+        # Let the daemon finish answering what it has already received
+        sock.shutdown(socket.SHUT_WR)
+    except OSError:
+        pass
+    replies.join()
+    sock.close()
+
+
+def main():
+    sock = connect_or_start()
+    if sock is None:
+        sys.path.insert(0, HERE)
+        import native_host
+        native_host.main()
+        return
+    relay(sock)
+
+
+if __name__ == '__main__':
+    if sys.platform == "win32":
+        import msvcrt
+        msvcrt.setmode(sys.stdin.fileno(), os.O_BINARY)
+        msvcrt.setmode(sys.stdout.fileno(), os.O_BINARY)
+
+    main()
@@ -5,7 +5,7 @@ a = Analysis(
     ['native_host.py'],
     pathex=[],
     binaries=[],
-    datas=[],
+    datas=[('public_suffix_list.dat', '.')],
     hiddenimports=[],
     hookspath=[],
     hooksconfig={},
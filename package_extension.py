@@ -19,6 +19,7 @@ def package_extension():
         'content.js',
         'popup.html',
         'popup.js',
+        'native_port.js',
         'popup.css',
     ]
     
@@ -0,0 +1,77 @@
+"""Public suffixes from the Mozilla Public Suffix List.
+
+A public suffix is a domain under which anyone can register names, such as
+com, co.kr or github.io, so hosts below different registrations of the same
+suffix belong to different owners. public_suffix_list.dat is a copy of
+https://publicsuffix.org/list/public_suffix_list.dat (including its private
+section); replace it with a fresh download to update the rules.
+"""
+import ipaddress
+import os
+from functools import lru_cache
+
+PSL_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "public_suffix_list.dat")
+
+
+def _variants(rule: str):
+    # The list spells internationalised names in Unicode; URLs give them in punycode
+    yield rule
+    try:
+        ascii_rule = rule.encode("idna").decode("ascii")
+    except UnicodeError:
+        return
+    if ascii_rule != rule:
+        yield ascii_rule
+
+
+@lru_cache(maxsize=None)
+def _rules():
+    """(suffixes, wildcards, exceptions) parsed from PSL_FILE."""
+    suffixes, wildcards, exceptions = set(), set(), set()
+    with open(PSL_FILE, encoding="utf-8") as f:
+        for line in f:
+            rule = line.split()[0].lower() if line.strip() else ""
+            if not rule or rule.startswith("//"):
+                continue
+            if rule.startswith("!"):
+                exceptions.update(_variants(rule[1:]))
+            elif rule.startswith("*."):
+                wildcards.update(_variants(rule[2:]))
+            else:
+                suffixes.update(_variants(rule))
+    return suffixes, wildcards, exceptions
+
+
+def is_ip(host: str) -> bool:
+    try:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
+        return False
+
+
+def public_suffix(host: str) -> str:
+    """The longest public suffix of a normalized host; its last label if none is listed."""
+    suffixes, wildcards, exceptions = _rules()
+    labels = host.split(".")
+    for i in range(len(labels)):
+        name = ".".join(labels[i:])
+        if name in exceptions:
+            return ".".join(labels[i + 1:])
+        if name in suffixes or ".".join(labels[i + 1:]) in wildcards:
+            return name
+    return labels[-1]
+
+
+def registrable_domain(host: str) -> str:
+    """e.g. example.co.uk for login.example.co.uk.
+
+    IPs, single labels and hosts that are themselves public suffixes map
+    to themselves.
+    """
+    if not host or is_ip(host):
+        return host or ""
+    suffix = public_suffix(host)
+    if suffix == host:
+        return host
+    return ".".join(host.split(".")[-(suffix.count(".") + 2):])
@@ -0,0 +1,276 @@
+"""Decrypted, immutable in-memory snapshots of the vault for read endpoints.
+
+A ReadModel holds one Snapshot per unlocked key. Request threads share the
+current snapshot without locking. After a write, the next reader rebuilds
+it: the block table is re-read, but only rows whose ciphertext changed are
+decrypted again. Everything else is carried over from the previous
+snapshot, which stays untouched for readers still using it. Writes are
+noticed through db_handler commit listeners (this process) and changes to
+the vault file's size or mtime (other processes such as the desktop app or
+native host).
+
+Environment:
+    READ_MODEL          set to 1 to serve reads from snapshots
+    READ_MODEL_MAX_MB   memory budget across all keys (default 256)
+    READ_MODEL_MAX_KEYS most keys with a snapshot at once (default 64)
+"""
+import bisect
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from db_handler import DatabaseManager, SimpleCipher, add_commit_listener, get_pool
+
+# Rough per-block bookkeeping cost on top of its plaintext
+ENTRY_OVERHEAD = 400
+
+
+def _digest(enc: str) -> bytes:
+    return hashlib.blake2b(enc.encode(), digest_size=16).digest()
+
+
+def _file_signature(path: str):
+    sig = []
+    for name in (path, path + "-wal"):
+        try:
+            st = os.stat(name)
+            sig.append((st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            sig.append(None)
+    return tuple(sig)
+
+
+class Snapshot:
+    """One consistent, read-only view of the vault at a revision.
+
+    Implements the read methods of DatabaseManager that the web views use.
+    Payloads are shared with later snapshots and with callers, so they must
+    not be mutated.
+    """
+
+    def __init__(self, revision, folders, folder_revs, blocks, digests, nbytes):
+        self._revision = revision
+        self._folders = folders         # [(id, name)] in display order
+        self._folder_revs = folder_revs  # id -> folders.rev
+        self._blocks = blocks           # folder id -> [(id, type, data)] in display order
+        self._digests = digests         # block id -> (ciphertext digest, type, data)
+        self.nbytes = nbytes
+        names = dict(folders)
+        self._credentials = sorted(
+            (bid, names[fid], data)
+            for fid, rows in blocks.items()
+            for bid, btype, data in rows
+            if btype == "Credential"
+        )
+        self._credential_ids = [c[0] for c in self._credentials]
+
+    def revision(self) -> int:
+        return self._revision
+
+    def fetch_folders(self):
+        return self._folders
+
+    def folder_revision(self, fid):
+        return self._folder_revs.get(fid)
+
+    def fetch_blocks(self, fid):
+        return self._blocks.get(fid, [])
+
+    def iter_credentials(self, after_id: int = None, limit: int = None):
+        """Same rows, in the same id order, as DatabaseManager.iter_credentials."""
+        start = bisect.bisect_right(self._credential_ids, after_id or 0)
+        end = len(self._credentials) if limit is None else start + limit
+        return iter(self._credentials[start:end])
+
+
+class ReadModel:
+    """Snapshots for one vault key."""
+
+    def __init__(self, cipher: SimpleCipher, path: str):
+        self.cipher = cipher
+        self.path = path
+        self.current = None
+        self._signature = None
+        self._dirty = True
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        self._dirty = True
+
+    def _stale(self):
+        return self._dirty or self._signature != _file_signature(self.path)
+
+    def peek(self):
+        """The current snapshot if it is up to date, without rebuilding it."""
+        snap = self.current
+        return snap if snap is not None and not self._stale() else None
+
+    def snapshot(self):
+        """The current snapshot, rebuilt first if the vault changed.
+
+        Returns None if this key no longer opens the vault, e.g. after a
+        re-key.
+        """
+        snap = self.current
+        if snap is not None and not self._stale():
+            return snap
+        with self._lock:
+            if self.current is None or self._stale():
+                self._rebuild()
+            return self.current
+
+    def _rebuild(self):
+        # Clear the flag and take the file signature before reading, so a
+        # write that lands during the rebuild triggers another one
+        self._dirty = False
+        self._signature = _file_signature(self.path)
+        try:
+            self._load()
+        except BaseException:
+            self._dirty = True
+            raise
+
+    def _load(self):
+        db = DatabaseManager(self.cipher, pool=get_pool(self.path))
+        conn = db.conn
+        own_txn = not conn.in_transaction
+        if own_txn:
+            conn.execute("BEGIN")
+        try:
+            test = conn.execute("SELECT v FROM meta WHERE k='test'").fetchone()
+            if not test or self.cipher.decrypt(test[0]) != "vault-test":
+                self.current = None
+                return
+            revision = db.revision()
+            folder_rows = conn.execute(
+                "SELECT id, name, rev FROM folders ORDER BY sort, id"
+            ).fetchall()
+            rows = conn.execute(
+                "SELECT id, folder_id, type, content FROM blocks ORDER BY sort, id"
+            ).fetchall()
+        finally:
+            if own_txn:
+                conn.commit()
+
+        prev = self.current._digests if self.current is not None else {}
+        digests, todo, nbytes = {}, [], 0
+        for bid, _, btype, enc in rows:
+            digest = _digest(enc)
+            old = prev.get(bid)
+            if old is not None and old[0] == digest and old[1] == btype:
+                digests[bid] = old
+            else:
+                todo.append((bid, btype, enc, digest))
+            nbytes += len(enc) * 3 // 4 + ENTRY_OVERHEAD
+        plain = self.cipher.decrypt_many([enc for _, _, enc, _ in todo])
+        for (bid, btype, _, digest), text in zip(todo, plain):
+            try:
+                data = json.loads(text)
+            except ValueError:
+                data = {}
+            digests[bid] = (digest, btype, data)
+
+        blocks = {fid: [] for fid, _, _ in folder_rows}
+        for bid, fid, btype, _ in rows:
+            if fid in blocks:
+                blocks[fid].append((bid, btype, digests[bid][2]))
+        self.current = Snapshot(
+            revision,
+            [(fid, name) for fid, name, _ in folder_rows],
+            {fid: rev for fid, _, rev in folder_rows},
+            blocks,
+            digests,
+            nbytes,
+        )
+
+    def wipe(self):
+        with self._lock:
+            self.current = None
+            self._dirty = True
+
+
+class ReadModels:
+    """ReadModel per vault key, within a shared memory budget.
+
+    When the snapshots together exceed max_bytes, or more than max_keys keys
+    are held, the least recently used keys are dropped (never the one being
+    read); their next read rebuilds from SQLite. Keys that do not open the
+    vault are not kept.
+    """
+
+    def __init__(self, max_bytes: int = None, path: str = None, max_keys: int = None):
+        self.max_bytes = max_bytes or int(os.environ.get("READ_MODEL_MAX_MB", 256)) * 1024 * 1024
+        self.max_keys = max_keys or int(os.environ.get("READ_MODEL_MAX_KEYS", 64))
+        self.path = path or get_pool().path
+        self._models = OrderedDict()  # key digest -> ReadModel
+        self._lock = threading.Lock()
+        self.rebuilds = 0
+        add_commit_listener(self._on_commit)
+
+    def _on_commit(self, path):
+        if path == self.path:
+            with self._lock:
+                models = list(self._models.values())
+            for model in models:
+                model.invalidate()
+
+    @staticmethod
+    def _id(key_hex: str) -> str:
+        return hashlib.blake2b(key_hex.encode(), digest_size=16).hexdigest()
+
+    def snapshot(self, key_hex: str):
+        """Snapshot for a session key, or None if the key does not open the vault."""
+        kid = self._id(key_hex)
+        with self._lock:
+            model = self._models.get(kid)
+            if model is None:
+                model = self._models[kid] = ReadModel(
+                    SimpleCipher(key=bytes.fromhex(key_hex)), self.path
+                )
+            self._models.move_to_end(kid)
+        before = model.current
+        snap = model.snapshot()
+        if snap is None:
+            # Wrong key (or one retired by a re-key): forget it
+            with self._lock:
+                if self._models.get(kid) is model:
+                    del self._models[kid]
+            model.wipe()
+            return None
+        if snap is not before:
+            with self._lock:
+                self.rebuilds += 1
+            self._enforce_budget(kid)
+        return snap
+
+    def _enforce_budget(self, keep: str):
+        with self._lock:
+            total = sum(m.current.nbytes for m in self._models.values() if m.current)
+            for kid in list(self._models):
+                if kid == keep or (
+                    total <= self.max_bytes and len(self._models) <= self.max_keys
+                ):
+                    continue
+                model = self._models.pop(kid)
+                if model.current is not None:
+                    total -= model.current.nbytes
+                model.wipe()
+
+    def drop(self, key_hex: str):
+        """Wipe a key's snapshot, e.g. on logout."""
+        with self._lock:
+            model = self._models.pop(self._id(key_hex), None)
+        if model is not None:
+            model.wipe()
+
+    def stats(self) -> dict:
+        with self._lock:
+            snaps = [m.current for m in self._models.values() if m.current is not None]
+            return {
+                "keys": len(self._models),
+                "bytes": sum(s.nbytes for s in snaps),
+                "blocks": sum(len(s._digests) for s in snaps),
+                "rebuilds": self.rebuilds,
+            }
@@ -0,0 +1,112 @@
+import re
+from collections import defaultdict
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def block_text(btype: str, data) -> str:
+    """Searchable text for a block; never includes the password field."""
+    if btype == "Credential" and isinstance(data, dict):
+        parts = [data.get(k) or "" for k in ("site", "username", "email", "notes")]
+        for k, v in (data.get("custom") or {}).items():
+            parts += [k, str(v)]
+    elif isinstance(data, dict):
+        parts = [f"{k} {v}" for k, v in data.items()]
+    elif isinstance(data, list):
+        parts = [" ".join(str(c) for c in row) for row in data]
+    else:
+        parts = [str(data or "")]
+    return " ".join(p for p in parts if p).lower()
+
+
+def _trigrams(text: str):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class SearchIndex:
+    """In-memory substring index over decrypted blocks.
+
+    Each block's searchable text is indexed by its words and character
+    trigrams. Query terms of three or more characters are answered by
+    intersecting trigram postings, shorter ones through the word vocabulary,
+    and every candidate is confirmed against the stored text.
+    """
+
+    def __init__(self):
+        self._docs = {}  # bid -> (folder_id, btype, text)
+        self._grams = defaultdict(set)
+        self._words = defaultdict(set)
+
+    def __len__(self):
+        return len(self._docs)
+
+    def build(self, blocks):
+        """Index an iterable of (bid, folder_id, btype, data)."""
+        for bid, folder_id, btype, data in blocks:
+            self.add(bid, folder_id, btype, data)
+
+    def add(self, bid: int, folder_id: int, btype: str, data):
+        if bid in self._docs:
+            self.remove(bid)
+        text = block_text(btype, data)
+        self._docs[bid] = (folder_id, btype, text)
+        for gram in _trigrams(text):
+            self._grams[gram].add(bid)
+        for word in set(_WORD_RE.findall(text)):
+            self._words[word].add(bid)
+
+    def update(self, bid: int, data):
+        doc = self._docs.get(bid)
+        if doc is not None:
+            self.add(bid, doc[0], doc[1], data)
+
+    def remove(self, bid: int):
+        doc = self._docs.pop(bid, None)
+        if doc is None:
+            return
+        text = doc[2]
+        for gram in _trigrams(text):
+            self._discard(self._grams, gram, bid)
+        for word in set(_WORD_RE.findall(text)):
+            self._discard(self._words, word, bid)
+
+    def remove_folder(self, folder_id: int):
+        for bid in [b for b, doc in self._docs.items() if doc[0] == folder_id]:
+            self.remove(bid)
+
+    @staticmethod
+    def _discard(postings, key, bid):
+        ids = postings.get(key)
+        if ids is not None:
+            ids.discard(bid)
+            if not ids:
+                del postings[key]
+
+    def _candidates(self, term: str):
+        if len(term) >= 3:
+            lists = sorted((self._grams.get(g, ()) for g in _trigrams(term)), key=len)
+            if not lists[0]:
+                return set()
+            return set(lists[0]).intersection(*lists[1:])
+        out = set()
+        for word, ids in self._words.items():
+            if term in word:
+                out |= ids
+        return out
+
+    def search(self, query: str, folder_id: int = None):
+        """Return ids of blocks containing every whitespace-separated term."""
+        terms = query.lower().split()
+        if terms:
+            terms.sort(key=len, reverse=True)
+            ids = self._candidates(terms[0])
+        else:
+            ids = set(self._docs)
+        hits = []
+        for bid in ids:
+            fid, _, text = self._docs[bid]
+            if folder_id is not None and fid != folder_id:
+                continue
+            if all(t in text for t in terms):
+                hits.append(bid)
+        return sorted(hits)
@@ -0,0 +1,44 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db_handler
+from db_handler import ConnectionPool, DatabaseManager, setup_new_vault
+
+PASSWORD = "correct horse battery staple"
+
+
+@pytest.fixture(autouse=True)
+def fast_kdf(monkeypatch):
+    # Real iteration counts cost ~100 ms per vault; the tests are about storage
+    monkeypatch.setattr(db_handler, "MIN_KDF_ITERATIONS", 1000)
+
+
+@pytest.fixture
+def vault_dir(tmp_path, monkeypatch):
+    """Run in an empty directory, with fresh pools, as the apps do next to vault.db."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(db_handler, "_pools", {})
+    yield tmp_path
+    for pool in db_handler._pools.values():
+        pool.close_all()
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = ConnectionPool(str(tmp_path / "vault.db"))
+    yield pool
+    pool.close_all()
+
+
+@pytest.fixture
+def cipher(pool):
+    return setup_new_vault(PASSWORD, pool=pool, iterations=1000)
+
+
+@pytest.fixture
+def db(pool, cipher):
+    return DatabaseManager(cipher, pool=pool)
@@ -0,0 +1,103 @@
+import pytest
+
+from conftest import PASSWORD
+from db_handler import DatabaseManager, setup_new_vault
+
+
+@pytest.fixture
+def api(vault_dir):
+    import web_app
+
+    cipher = setup_new_vault(PASSWORD, iterations=1000)
+    db = DatabaseManager(cipher)
+    client = web_app.app.test_client()
+    headers = {"X-Vault-Key": cipher.key.hex()}
+
+    def batch(*ops):
+        resp = client.post("/api/batch", json={"ops": list(ops)}, headers=headers)
+        return resp.status_code, resp.get_json()
+
+    batch.db = db
+    batch.client = client
+    batch.headers = headers
+    return batch
+
+
+def folder_names(db):
+    return [name for _, name in db.fetch_folders()]
+
+
+def test_applies_ops_in_one_transaction(api):
+    status, body = api({"op": "add_folder", "name": "Work"})
+    assert status == 200
+    fid = body["results"][0]["id"]
+
+    status, body = api(
+        {"op": "add_block", "folder_id": fid, "type": "Credential",
+         "content": {"site": "https://example.com", "username": "alice"}},
+        {"op": "add_block", "folder_id": fid, "type": "Text", "content": "note"},
+        {"op": "rename_folder", "id": fid, "name": "Office"},
+    )
+    assert status == 200
+    assert body["success"] is True
+    assert body["revision"] == api.db.revision()
+    text_id = body["results"][1]["id"]
+
+    status, body = api({"op": "move_block", "id": text_id, "before": body["results"][0]["id"]})
+    assert status == 200
+    assert [btype for _, btype, _ in api.db.fetch_blocks(fid)] == ["Text", "Credential"]
+    assert folder_names(api.db) == ["Office"]
+
+
+def test_failed_op_rolls_back_the_batch(api):
+    revision = api.db.revision()
+    status, body = api(
+        {"op": "add_folder", "name": "Kept?"},
+        {"op": "delete_block", "id": 12345},
+        {"op": "add_folder", "name": "Never run"},
+    )
+    assert status == 409
+    assert body["failed_index"] == 1
+    assert [r["ok"] for r in body["results"]] == [False, False, False]
+    assert "12345" in body["results"][1]["error"]
+    assert folder_names(api.db) == []
+    assert api.db.revision() == revision
+
+
+@pytest.mark.parametrize("op, error", [
+    ({"op": "explode"}, "unknown op"),
+    ({"op": "add_folder"}, "name is required"),
+    ({"op": "delete_folder", "id": True}, "id is required"),
+    ({"op": "move_block", "id": 1}, "give exactly one of before/after"),
+    ({"op": "move_block", "id": 1, "before": 2, "after": 3}, "give exactly one of before/after"),
+    ({"op": "move_folder", "id": 1, "before": "2"}, "before must be an id"),
+    ({"op": "add_block", "folder_id": 1, "type": "Video", "content": "x"}, "unknown block type"),
+    ({"op": "add_block", "folder_id": 1, "type": "Credential", "content": "oops"},
+     "Credential content must be an object"),
+    ({"op": "add_block", "folder_id": 1, "type": "Credential", "content": {"site": 1}},
+     "Credential fields must be strings"),
+    ({"op": "add_block", "folder_id": 1, "type": "Text", "content": {"a": "b"}},
+     "Text content must be a string"),
+])
+def test_malformed_ops_are_rejected_before_anything_runs(api, op, error):
+    status, body = api({"op": "add_folder", "name": "Fine"}, op)
+    assert status == 400
+    assert body["results"] == [{"ok": True}, {"ok": False, "error": error}]
+    assert folder_names(api.db) == []
+
+
+def test_update_block_content_must_match_its_type(api):
+    fid = api.db.add_folder("Sites")
+    bid = api.db.add_block(fid, "Credential", {"site": "https://example.com"})
+    status, body = api({"op": "update_block", "id": bid, "content": "oops"})
+    assert status == 409
+    assert body["results"][0]["error"] == "Credential content must be an object"
+
+    resp = api.client.get("/api/entries", headers=api.headers)
+    assert resp.status_code == 200
+    assert [e["site"] for e in resp.get_json()["entries"]] == ["https://example.com"]
+
+
+def test_requires_a_key(api):
+    resp = api.client.post("/api/batch", json={"ops": [{"op": "add_folder", "name": "x"}]})
+    assert resp.status_code == 401
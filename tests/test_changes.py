@@ -0,0 +1,72 @@
+def credential(site):
+    return {"site": site, "username": "alice", "password": "pw"}
+
+
+def summary(changes):
+    return [(op, bid, data and data["site"]) for op, bid, _, data in changes]
+
+
+def test_changes_since_reports_latest_state_per_block(db):
+    fid = db.add_folder("Sites")
+    start = db.revision()
+    a = db.add_block(fid, "Credential", credential("a.example"))
+    b = db.add_block(fid, "Credential", credential("b.example"))
+    db.add_block(fid, "Text", "not synced")
+    db.update_block(a, credential("a2.example"))
+    db.delete_block(b)
+
+    revision, reset, changes = db.changes_since(start)
+    assert revision == db.revision()
+    assert reset is False
+    assert summary(changes) == [("upsert", a, "a2.example"), ("delete", b, None)]
+
+
+def test_changes_since_current_revision_is_empty(db):
+    fid = db.add_folder("Sites")
+    db.add_block(fid, "Credential", credential("a.example"))
+    assert db.changes_since(db.revision()) == (db.revision(), False, [])
+
+
+def test_compaction_keeps_changes_since_results(db):
+    fid = db.add_folder("Sites")
+    start = db.revision()
+    a = db.add_block(fid, "Credential", credential("a.example"))
+    for i in range(5):
+        db.update_block(a, credential(f"a{i}.example"))
+    b = db.add_block(fid, "Credential", credential("b.example"))
+    middle = db.revision()
+    db.update_block(b, credential("b2.example"))
+
+    before = [db.changes_since(since) for since in (start, middle)]
+    db.compact_changes()
+    assert db.conn.execute("SELECT COUNT(*) FROM changes").fetchone()[0] == 2
+    assert [db.changes_since(since) for since in (start, middle)] == before
+
+
+def test_pruning_raises_the_floor(db):
+    fid = db.add_folder("Sites")
+    old = db.revision()
+    a = db.add_block(fid, "Credential", credential("a.example"))
+    b = db.add_block(fid, "Credential", credential("b.example"))
+    recent = db.revision()
+    db.update_block(b, credential("b2.example"))
+
+    db.compact_changes(keep_revisions=1)
+    floor = db.revision() - 1
+    assert db._meta_int("changes_floor") == floor
+
+    # Too old for the log: the client must refetch everything
+    revision, reset, changes = db.changes_since(old)
+    assert (revision, reset, changes) == (db.revision(), True, [])
+    # Still covered by the log
+    assert summary(db.changes_since(recent)[2]) == [("upsert", b, "b2.example")]
+    assert db.changes_since(floor)[1] is False
+    assert a not in [bid for _, bid, _, _ in db.changes_since(floor)[2]]
+
+
+def test_deleting_a_folder_logs_its_blocks(db):
+    fid = db.add_folder("Sites")
+    a = db.add_block(fid, "Credential", credential("a.example"))
+    start = db.revision()
+    db.delete_folder(fid)
+    assert summary(db.changes_since(start)[2]) == [("delete", a, None)]
@@ -0,0 +1,64 @@
+import base64
+import threading
+from itertools import cycle
+
+import pytest
+
+from db_handler import SimpleCipher
+
+KEY = bytes(range(7, 39))
+
+
+def legacy_encrypt(key, text):
+    # The byte-at-a-time cipher every existing vault was written with
+    data = text.encode()
+    return base64.b64encode(bytes(b ^ k for b, k in zip(data, cycle(key)))).decode()
+
+
+@pytest.mark.parametrize("text", [
+    "a",
+    "x" * 31,
+    "y" * 32,
+    "z" * 33,
+    '{"site": "https://example.com", "password": "päss ☃"}',
+    "long " * 2000,
+])
+def test_matches_legacy_xor(text):
+    cipher = SimpleCipher(key=KEY)
+    token = cipher.encrypt(text)
+    assert token == legacy_encrypt(KEY, text)
+    assert cipher.decrypt(token) == text
+
+
+def test_reads_legacy_tokens_after_growing_the_stream():
+    cipher = SimpleCipher(key=KEY)
+    cipher.encrypt("w" * 10_000)
+    short = "short secret"
+    assert cipher.decrypt(legacy_encrypt(KEY, short)) == short
+
+
+def test_empty_and_invalid_tokens():
+    cipher = SimpleCipher(key=KEY)
+    assert cipher.encrypt("") == ""
+    assert cipher.decrypt("") == ""
+    assert cipher.decrypt("not base64!") == ""
+
+
+def test_shared_cipher_across_threads():
+    cipher = SimpleCipher(key=KEY)
+    failures = []
+
+    def work(size):
+        text = "q" * size
+        for _ in range(200):
+            if cipher.encrypt(text) != legacy_encrypt(KEY, text):
+                failures.append(size)
+            # Force the buffer to be regrown concurrently with other threads
+            cipher._stream = cipher.key
+
+    threads = [threading.Thread(target=work, args=(n,)) for n in (5000, 40, 3000, 70)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert failures == []
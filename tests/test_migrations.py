@@ -0,0 +1,110 @@
+import base64
+import json
+import os
+import sqlite3
+
+import pytest
+
+import migrations
+from conftest import PASSWORD
+from db_handler import ConnectionPool, DatabaseManager, SimpleCipher, check_master_password
+
+
+def make_baseline_vault(path):
+    """A vault.db as the 2.0 release wrote it: no migrations, foreign keys off."""
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (k TEXT PRIMARY KEY, v TEXT)")
+    conn.execute("""CREATE TABLE IF NOT EXISTS folders (
+                      id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      name TEXT NOT NULL,
+                      sort INTEGER DEFAULT 0
+                    )""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS blocks (
+                      id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      folder_id INTEGER NOT NULL,
+                      type TEXT NOT NULL,
+                      content TEXT NOT NULL,
+                      sort INTEGER DEFAULT 0,
+                      FOREIGN KEY(folder_id) REFERENCES folders(id) ON DELETE CASCADE
+                    )""")
+    salt = os.urandom(16)
+    cipher = SimpleCipher(PASSWORD, salt)
+    conn.execute("INSERT INTO meta (k,v) VALUES ('salt',?)", (base64.b64encode(salt).decode(),))
+    conn.execute("INSERT INTO meta (k,v) VALUES ('test',?)", (cipher.encrypt("vault-test"),))
+    for fid, name in ((1, "Work"), (2, "Old")):
+        conn.execute("INSERT INTO folders (id,name,sort) VALUES (?,?,?)", (fid, name, fid))
+    blocks = [
+        (1, "Credential", {"site": "https://example.com", "username": "alice"}),
+        (1, "Text", "keep me"),
+        (2, "Credential", {"site": "https://old.example"}),
+        (2, "Text", "orphan"),
+    ]
+    for i, (fid, btype, content) in enumerate(blocks, 1):
+        conn.execute(
+            "INSERT INTO blocks (folder_id,type,content,sort) VALUES (?,?,?,?)",
+            (fid, btype, cipher.encrypt(json.dumps(content)), i),
+        )
+    # Without PRAGMA foreign_keys this left folder 2's blocks behind
+    conn.execute("DELETE FROM folders WHERE id=2")
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture
+def baseline_pool(tmp_path):
+    path = str(tmp_path / "vault.db")
+    make_baseline_vault(path)
+    pool = ConnectionPool(path)
+    yield pool
+    pool.close_all()
+
+
+def test_migrates_a_baseline_vault(baseline_pool):
+    conn = baseline_pool.connection()
+    applied = [version for version, _, _ in baseline_pool.migration_report]
+    assert applied == [version for version, _, _ in migrations.MIGRATIONS]
+    assert migrations.current_version(conn) == applied[-1]
+
+    ok, cipher = check_master_password(PASSWORD, pool=baseline_pool)
+    assert ok
+    db = DatabaseManager(cipher, pool=baseline_pool)
+    assert db.fetch_folders() == [(1, "Work")]
+    assert [(btype, data) for _, btype, data in db.fetch_blocks(1)] == [
+        ("Credential", {"site": "https://example.com", "username": "alice"}),
+        ("Text", "keep me"),
+    ]
+    # Orphans from the deleted folder are gone
+    assert conn.execute("SELECT COUNT(*) FROM blocks").fetchone()[0] == 2
+    assert conn.execute(
+        "SELECT COUNT(*) FROM blocks WHERE size IS NULL OR updated_at IS NULL"
+    ).fetchone()[0] == 0
+    assert db.revision() == 0
+    assert db.changes_since(0) == (0, False, [])
+
+
+def test_migrated_vault_logs_new_writes(baseline_pool):
+    ok, cipher = check_master_password(PASSWORD, pool=baseline_pool)
+    db = DatabaseManager(cipher, pool=baseline_pool)
+    rev = db.folder_revision(1)
+    bid = db.add_block(1, "Credential", {"site": "https://new.example"})
+    assert db.folder_revision(1) != rev
+    revision, reset, changes = db.changes_since(0)
+    assert (revision, reset) == (1, False)
+    assert [(op, b) for op, b, _, _ in changes] == [("upsert", bid)]
+
+
+def test_migrations_run_once(baseline_pool):
+    baseline_pool.connection()
+    again = ConnectionPool(baseline_pool.path)
+    try:
+        again.connection()
+        assert again.migration_report == []
+    finally:
+        again.close_all()
+
+
+def test_foreign_keys_are_enforced_after_migration(baseline_pool):
+    ok, cipher = check_master_password(PASSWORD, pool=baseline_pool)
+    db = DatabaseManager(cipher, pool=baseline_pool)
+    db.delete_folder(1)
+    assert baseline_pool.connection().execute("SELECT COUNT(*) FROM blocks").fetchone()[0] == 0
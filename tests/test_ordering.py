@@ -0,0 +1,87 @@
+import pytest
+
+
+def block_order(db, fid):
+    return [bid for bid, _, _ in db.fetch_blocks(fid)]
+
+
+@pytest.fixture
+def folder(db):
+    fid = db.add_folder("Work")
+    bids = db.add_blocks(fid, [("Text", f"block {i}") for i in range(5)])
+    return fid, bids
+
+
+def test_move_block_before_and_after(db, folder):
+    fid, (a, b, c, d, e) = folder
+    db.move_block(e, before=a)
+    assert block_order(db, fid) == [e, a, b, c, d]
+    db.move_block(a, after=d)
+    assert block_order(db, fid) == [e, b, c, d, a]
+    db.move_block(c, after=e)
+    assert block_order(db, fid) == [e, c, b, d, a]
+
+
+def test_move_block_writes_one_row(db, folder):
+    fid, (a, b, c, d, e) = folder
+    sorts = dict(db.conn.execute("SELECT id, sort FROM blocks"))
+    db.move_block(a, after=c)
+    after = dict(db.conn.execute("SELECT id, sort FROM blocks"))
+    assert [bid for bid in sorts if sorts[bid] != after[bid]] == [a]
+
+
+def test_move_block_into_another_folder(db, folder):
+    fid, (a, b, c, d, e) = folder
+    other = db.add_folder("Home")
+    x = db.add_block(other, "Text", "x")
+    db.move_block(b, before=x)
+    assert block_order(db, other) == [b, x]
+    assert block_order(db, fid) == [a, c, d, e]
+
+
+def test_move_folder(db):
+    f1, f2, f3 = (db.add_folder(name) for name in ("one", "two", "three"))
+    db.move_folder(f3, before=f1)
+    assert [fid for fid, _ in db.fetch_folders()] == [f3, f1, f2]
+    db.move_folder(f3, after=f2)
+    assert [fid for fid, _ in db.fetch_folders()] == [f1, f2, f3]
+
+
+def test_rebalance_when_gap_runs_out(db, folder):
+    fid, (a, b, c, d, e) = folder
+    # Each move halves the gap between a and the last block moved after it
+    expected = [a, b, c, d, e]
+    for _ in range(60):
+        mover = expected[-1]
+        db.move_block(mover, after=a)
+        expected.remove(mover)
+        expected.insert(1, mover)
+        assert block_order(db, fid) == expected
+    sorts = [s for (s,) in db.conn.execute(
+        "SELECT sort FROM blocks WHERE folder_id=? ORDER BY sort", (fid,)
+    )]
+    # Without renumbering the gaps would have shrunk to 2**-60
+    assert all(hi - lo >= db.RANK_EPSILON / 2 for lo, hi in zip(sorts, sorts[1:]))
+
+
+def test_shift_block_stops_at_the_ends(db, folder):
+    fid, (a, b, c, d, e) = folder
+    assert db.shift_block(a, -1) is False
+    assert db.shift_block(e, +1) is False
+    assert db.shift_block(a, +1) is True
+    assert block_order(db, fid) == [b, a, c, d, e]
+
+
+def test_bad_moves_leave_the_revision_alone(db, folder):
+    fid, (a, b, c, d, e) = folder
+    revision = db.revision()
+    with pytest.raises(ValueError):
+        db.move_block(999, before=a)
+    with pytest.raises(ValueError):
+        db.move_block(a, before=999)
+    with pytest.raises(ValueError):
+        db.move_block(a, after=a)
+    with pytest.raises(ValueError):
+        db.move_folder(999, after=fid)
+    assert db.revision() == revision
+    assert block_order(db, fid) == [a, b, c, d, e]
@@ -0,0 +1,177 @@
+"""Resident process that keeps the vault open for the browser extension.
+
+Without it, every sendNativeMessage call starts a fresh native_host.py,
+paying for Python start-up, imports, logging setup and a new SQLite
+connection, and losing the unlocked session and its indexes. The daemon
+owns the vault instead; native_launcher.py, which Chrome starts, only relays
+frames to it. Messages, replies and streaming are exactly those of
+native_host.py, and idle sessions are still wiped after NATIVE_SESSION_IDLE.
+
+The daemon listens on a UNIX socket (vault_daemon.sock) where the platform
+has AF_UNIX, and on a loopback TCP port otherwise. Its address and a random
+token go to vault_daemon.json, readable only by the current user, next to
+vault.db. A client's first frame must be {"token": ...}. Only one daemon
+runs per vault: it holds an exclusive lock on vault_daemon.lock for its
+whole life, so launchers that start daemons at the same moment cannot
+end up with two.
+
+Usage:
+    python vault_daemon.py
+    python vault_daemon.py --tcp
+"""
+import argparse
+import hmac
+import json
+import logging
+import os
+import secrets
+import signal
+import socket
+import sys
+import threading
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import native_host
+from native_launcher import ADDRESS_FILE, connect
+
+SOCKET_FILE = 'vault_daemon.sock'
+LOCK_FILE = 'vault_daemon.lock'
+
+
+def _lock():
+    """Open LOCK_FILE and lock it exclusively, or return None if another process holds it.
+
+    The lock lasts until the file is closed or the process exits.
+    """
+    f = open(LOCK_FILE, 'a+')
+    try:
+        if sys.platform == 'win32':
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return None
+    return f
+
+
+def _accepting(path):
+    """Whether something is listening on the UNIX socket at path."""
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        probe.close()
+
+
+def _listen(use_tcp):
+    if not use_tcp and hasattr(socket, 'AF_UNIX'):
+        path = os.path.abspath(SOCKET_FILE)
+        if os.path.exists(path):
+            if _accepting(path):
+                raise SystemExit("vault_daemon is already running")
+            # Left behind by a daemon that did not shut down cleanly
+            os.unlink(path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o177)
+        try:
+            sock.bind(path)
+        finally:
+            os.umask(umask)
+        sock.listen(16)
+        return sock, {'unix': path}
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(16)
+    return sock, {'tcp': list(sock.getsockname()[:2])}
+
+
+def _write_address(address):
+    tmp = ADDRESS_FILE + '.tmp'
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(address, f)
+    os.replace(tmp, ADDRESS_FILE)
+
+
+def _remove_files(address):
+    try:
+        with open(ADDRESS_FILE) as f:
+            ours = json.load(f).get('token') == address['token']
+    except (OSError, ValueError):
+        ours = False
+    if ours:
+        os.unlink(ADDRESS_FILE)
+        if 'unix' in address:
+            os.unlink(address['unix'])
+
+
+def handle_client(conn, token):
+    with conn:
+        rfile = conn.makefile('rb')
+        wfile = conn.makefile('wb')
+        try:
+            hello = native_host.read_frame(rfile)
+        except ValueError:
+            return
+        if not isinstance(hello, dict) or not hmac.compare_digest(
+            str(hello.get('token', '')).encode(), token.encode()
+        ):
+            logging.warning("Refused a daemon client with a bad token")
+            return
+        try:
+            native_host.serve(rfile, native_host.Channel(wfile))
+        except OSError:
+            pass
+
+
+def serve_forever(use_tcp=False):
+    # Held until exit, so checking for, listening as and advertising the
+    # daemon cannot interleave with another daemon starting up
+    lock = _lock()
+    if lock is None:
+        raise SystemExit("vault_daemon is already running")
+    existing = connect()
+    if existing is not None:
+        existing.close()
+        raise SystemExit("vault_daemon is already running")
+    sock, address = _listen(use_tcp)
+    address['token'] = secrets.token_hex(16)
+    address['pid'] = os.getpid()
+    _write_address(address)
+    native_host.start_reaper()
+    # Clean up the address file on a normal kill as well as on Ctrl+C
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    logging.info(f"vault_daemon listening on {address.get('unix') or address.get('tcp')}")
+    try:
+        while True:
+            conn, _ = sock.accept()
+            threading.Thread(
+                target=handle_client, args=(conn, address['token']),
+                name='daemon-client', daemon=True
+            ).start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sock.close()
+        _remove_files(address)
+        lock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tcp", action="store_true",
+                        help="listen on loopback TCP even where UNIX sockets exist")
+    args = parser.parse_args()
+    serve_forever(args.tcp)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,12 @@
 import os
+import json
 import logging
 
 import socket
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+from flask import (
+    Flask, Response, render_template, request, redirect, url_for, flash, session,
+    stream_with_context
+)
 try:
     from waitress import serve
 except ImportError:
@@ -10,11 +14,18 @@ except ImportError:
 from db_handler import (
     DatabaseManager,
     check_master_password,
+    get_pool,
     setup_new_vault,
     SimpleCipher
 )
+import compression
+import metrics
+from fragment_cache import FragmentCache, owner_id
+from read_model import ReadModels
+from kdf_executor import KdfBusy, KdfExecutor, LoginLimiter, LoginThrottled
 from flask import jsonify
 from flask_cors import CORS
+from markupsafe import Markup
 
 # Setup logging
 logging.basicConfig(
@@ -27,6 +38,81 @@ app = Flask(__name__)
 CORS(app) # Enable CORS for Chrome Extension
 app.secret_key = os.environ.get('SECRET_KEY', os.urandom(24).hex())
 
+# Key derivation runs on its own bounded pool so logins can't hold every
+# request thread; see kdf_executor.py
+kdf_pool = KdfExecutor()
+login_limiter = LoginLimiter()
+
+metrics.init_app(app)
+for _name, _stat, _kind, _help in (
+    ('kdf_queue_depth', 'queued', 'gauge', 'Password checks waiting for a KDF worker'),
+    ('kdf_running', 'running', 'gauge', 'Password checks being derived'),
+    ('kdf_rejected_total', 'rejected', 'counter', 'Password checks refused with 503'),
+    ('kdf_completed_total', 'completed', 'counter', 'Password checks finished'),
+    ('kdf_seconds_total', 'kdf_seconds_total', 'counter', 'Time spent deriving keys'),
+    ('kdf_seconds_max', 'kdf_seconds_max', 'gauge', 'Slowest key derivation'),
+):
+    metrics.registry.add(metrics.Callback(
+        'notionvault_' + _name, _help, lambda s=_stat: kdf_pool.stats()[s], kind=_kind))
+metrics.registry.add(metrics.Callback(
+    'notionvault_login_throttled_total', 'Login attempts refused with 429',
+    lambda: login_limiter.stats()['throttled'], kind='counter'))
+# Rendered block lists per logged-in key and folder; see _render_blocks
+fragments = FragmentCache(int(os.environ.get('FRAGMENT_CACHE_MB', 16)) * 1024 * 1024)
+metrics.registry.add(metrics.Callback(
+    'notionvault_fragment_cache_bytes', 'Rendered dashboard HTML held in memory',
+    lambda: fragments.stats()['bytes']))
+metrics.registry.add(metrics.Callback(
+    'notionvault_fragment_cache_hits_total', 'Dashboard block lists served from cache',
+    lambda: fragments.stats()['hits'], kind='counter'))
+metrics.registry.add(metrics.Callback(
+    'notionvault_db_connections', 'Pooled SQLite connections',
+    lambda: get_pool().stats()['size']))
+compression.init_app(app)
+
+# Optional shared in-memory snapshots for read endpoints; see read_model.py
+read_models = ReadModels() if os.environ.get('READ_MODEL') == '1' else None
+if read_models is not None:
+    for _name, _stat, _kind, _help in (
+        ('read_model_bytes', 'bytes', 'gauge', 'Estimated memory held by vault snapshots'),
+        ('read_model_keys', 'keys', 'gauge', 'Unlocked keys with a snapshot'),
+        ('read_model_rebuilds_total', 'rebuilds', 'counter', 'Snapshot rebuilds after writes'),
+    ):
+        metrics.registry.add(metrics.Callback(
+            'notionvault_' + _name, _help, lambda s=_stat: read_models.stats()[s], kind=_kind))
+
+def _reader(key_hex):
+    """Read-only vault access: the shared snapshot when enabled, else SQLite."""
+    if read_models is not None:
+        snap = read_models.snapshot(key_hex)
+        if snap is not None:
+            return snap
+    return DatabaseManager(SimpleCipher(key=bytes.fromhex(key_hex)))
+
+def _unlock(password):
+    """check_master_password on the KDF pool, throttled per client.
+
+    Returns the cipher, or None for a wrong password. Raises LoginThrottled
+    or KdfBusy when the attempt is refused before the password is checked.
+    """
+    client = request.remote_addr or 'unknown'
+    login_limiter.acquire(client)
+    ok = None
+    try:
+        ok, cipher = kdf_pool.run(check_master_password, password)
+    finally:
+        login_limiter.release(client, ok)
+    if not ok:
+        logging.warning(f"Failed login from {client}")
+    return cipher if ok else None
+
+def _refused(exc):
+    """(message, status, headers) for a login refused by the limiter or pool."""
+    if isinstance(exc, LoginThrottled):
+        return (f'Too many attempts, try again in {exc.retry_after} s', 429,
+                {'Retry-After': str(exc.retry_after)})
+    return 'Server busy, try again shortly', 503, {'Retry-After': '1'}
+
 @app.route('/')
 def index():
     if 'key' not in session:
@@ -35,7 +121,11 @@ def index():
 
 @app.route('/logout')
 def logout():
-    session.pop('key', None)
+    key_hex = session.pop('key', None)
+    if key_hex:
+        fragments.drop_owner(owner_id(key_hex))
+        if read_models is not None:
+            read_models.drop(key_hex)
     return redirect(url_for('login'))
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -43,8 +133,13 @@ def login():
     if request.method == 'POST':
         password = request.form.get('password')
         if password:
-            ok, cipher = check_master_password(password)
-            if ok:
+            try:
+                cipher = _unlock(password)
+            except (LoginThrottled, KdfBusy) as e:
+                message, status, headers = _refused(e)
+                flash(message, 'error')
+                return render_template('login.html'), status, headers
+            if cipher:
                 session['key'] = cipher.key.hex()
                 return redirect(url_for('dashboard'))
             else:
@@ -61,27 +156,75 @@ def setup():
         p1 = request.form.get('password1')
         p2 = request.form.get('password2')
         if p1 and p2 and p1 == p2 and len(p1) >= 8:
-            cipher = setup_new_vault(p1)
+            try:
+                cipher = kdf_pool.run(setup_new_vault, p1)
+            except KdfBusy as e:
+                message, status, headers = _refused(e)
+                flash(message, 'error')
+                return render_template('setup.html'), status, headers
+            except ValueError as e:
+                # Another setup request won the race
+                flash(str(e), 'error')
+                return redirect(url_for('login'))
             session['key'] = cipher.key.hex()
             return redirect(url_for('dashboard'))
         else:
             flash('Passwords must match and be at least 8 characters', 'error')
     return render_template('setup.html')
 
+def _not_modified(etag, vary):
+    """304 response if the client already holds etag, else None."""
+    # Weak match: compressed responses carry the same tag marked weak
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    resp = Response(status=304)
+    return _revalidate(resp, etag, vary)
+
+def _revalidate(resp, etag, vary):
+    # Clients may cache but must revalidate; unchanged vaults then cost a 304
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'private, no-cache'
+    resp.vary.update(vary)
+    return resp
+
+def _render_blocks(db, folder_id):
+    """A folder's rendered block list, reused until a write touches the folder."""
+    owner = owner_id(session['key'])
+    # Read the revision first: a write racing the render then only makes
+    # the cached copy newer than its revision, never older
+    rev = db.folder_revision(folder_id)
+    html = fragments.get(owner, folder_id, rev)
+    if html is None:
+        html = render_template(
+            '_blocks.html', blocks=db.fetch_blocks(folder_id), current_folder=folder_id
+        )
+        if rev is not None:
+            fragments.put(owner, folder_id, rev, html)
+    return Markup(html)
+
 @app.route('/dashboard')
 def dashboard():
     if 'key' not in session:
         return redirect(url_for('login'))
-    cipher = SimpleCipher(key=bytes.fromhex(session['key']))
-    db = DatabaseManager(cipher)
+    db = _reader(session['key'])
+    # Pending flash messages are rendered into the page, so never 304 them
+    etag = None
+    if '_flashes' not in session:
+        etag = f"{db.revision()}-{request.args.get('folder', '')}"
+        resp = _not_modified(etag, ['Cookie'])
+        if resp is not None:
+            return resp
     folders = db.fetch_folders()
     if folders:
-        folder_id = request.args.get('folder', folders[0][0])
-        blocks = db.fetch_blocks(folder_id)
+        folder_id = request.args.get('folder', folders[0][0], type=int)
+        blocks_html = _render_blocks(db, folder_id)
     else:
         folder_id = None
-        blocks = []
-    return render_template('dashboard.html', folders=folders, blocks=blocks, current_folder=folder_id)
+        blocks_html = ''
+    resp = app.make_response(render_template(
+        'dashboard.html', folders=folders, blocks_html=blocks_html, current_folder=folder_id
+    ))
+    return _revalidate(resp, etag, ['Cookie']) if etag else resp
 
 @app.route('/add_folder', methods=['POST'])
 def add_folder():
@@ -191,18 +334,8 @@ def move_block(bid, direction):
     db = DatabaseManager(cipher)
     # Get current folder
     folder_id = request.args.get('folder', 1)
-    blocks = db.fetch_blocks(int(folder_id))
-    ids = [b[0] for b in blocks]
-    try:
-        idx = ids.index(bid)
-        if direction == 'up' and idx > 0:
-            # Swap with previous
-            db.reorder_block(bid, blocks[idx-1][0])
-        elif direction == 'down' and idx < len(ids) - 1:
-            # Swap with next
-            db.reorder_block(bid, blocks[idx+1][0])
-    except ValueError:
-        pass
+    if direction in ('up', 'down'):
+        db.shift_block(bid, -1 if direction == 'up' else 1)
     return redirect(url_for('dashboard', folder=folder_id))
 
 # -------------------- API Endpoints for Extension --------------------
@@ -211,48 +344,258 @@ def api_login():
     data = request.get_json()
     password = data.get('password')
     if password:
-        ok, cipher = check_master_password(password)
-        if ok:
+        try:
+            cipher = _unlock(password)
+        except (LoginThrottled, KdfBusy) as e:
+            message, status, headers = _refused(e)
+            return jsonify({'success': False, 'error': message}), status, headers
+        if cipher:
             # Return the key in hex content for the extension to use or session token
             # For simplicity, we'll use a session-based approach
             session['key'] = cipher.key.hex()
             return jsonify({'success': True, 'key': cipher.key.hex()})
     return jsonify({'success': False, 'error': 'Invalid password'}), 401
 
+def _credential_entry(bid, fname, data):
+    return {
+        'id': bid,
+        'folder': fname,
+        'site': data.get('site', ''),
+        'username': data.get('username', ''),
+        'password': data.get('password', ''), # Be careful sending this
+        'url': data.get('site', ''),  # specific for extension auto-fill
+        'notes': data.get('notes', '')
+    }
+
+def _wants_ndjson():
+    best = request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson'])
+    return best == 'application/x-ndjson'
+
 @app.route('/api/entries', methods=['GET'])
 def api_get_entries():
     # Allow passing key via header or use session
     key_hex = request.headers.get('X-Vault-Key') or session.get('key')
     if not key_hex:
         return jsonify({'error': 'Unauthorized'}), 401
-    
+
+    limit = request.args.get('limit', type=int)
+    cursor = request.args.get('cursor', type=int)
+    if limit is not None and limit <= 0:
+        return jsonify({'error': 'limit must be positive'}), 400
+
+    try:
+        db = _reader(key_hex)
+        ndjson = _wants_ndjson()
+        etag = f"{db.revision()}{'-ndjson' if ndjson else ''}"
+        vary = ['Accept', 'X-Vault-Key', 'Cookie']
+        resp = _not_modified(etag, vary)
+        if resp is not None:
+            return resp
+
+        # Optional filters are answered from the blind index when it is enabled
+        query = request.args.get('q')
+        site = request.args.get('site')
+        if query or site:
+            if not isinstance(db, DatabaseManager):
+                # Filters are answered by the blind index in SQLite
+                db = DatabaseManager(SimpleCipher(key=bytes.fromhex(key_hex)))
+            rows = db.search_credentials(query=query, site=site, after_id=cursor)
+        else:
+            # One extra row tells us whether there is a next page
+            rows = db.iter_credentials(
+                after_id=cursor, limit=limit + 1 if limit else None
+            )
+
+        def page():
+            # Yields entries, then the next cursor (or None) as the last item
+            count, last_id = 0, None
+            for bid, fname, data in rows:
+                if limit and count == limit:
+                    yield last_id
+                    return
+                last_id = bid
+                count += 1
+                yield _credential_entry(bid, fname, data)
+            yield None
+
+        if ndjson:
+            def generate():
+                try:
+                    for item in page():
+                        if isinstance(item, dict):
+                            yield json.dumps(item) + '\n'
+                        elif item is not None:
+                            yield json.dumps({'next_cursor': item}) + '\n'
+                except Exception as e:
+                    logging.exception(f"Streaming /api/entries failed: {e}")
+                    # The 200 status is already sent; tell the client the list is cut short
+                    yield json.dumps({'error': str(e)}) + '\n'
+            resp = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+            return _revalidate(resp, etag, vary)
+
+        all_entries = list(page())
+        next_cursor = all_entries.pop()
+        body = {'entries': all_entries}
+        if limit:
+            body['next_cursor'] = next_cursor
+        return _revalidate(jsonify(body), etag, vary)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/changes', methods=['GET'])
+def api_get_changes():
+    key_hex = request.headers.get('X-Vault-Key') or session.get('key')
+    if not key_hex:
+        return jsonify({'error': 'Unauthorized'}), 401
+    since = request.args.get('since', type=int)
+    if since is None:
+        return jsonify({'error': 'since is required'}), 400
+
     try:
         cipher = SimpleCipher(key=bytes.fromhex(key_hex))
         db = DatabaseManager(cipher)
-        
-        # Get all folders
-        folders = db.fetch_folders()
-        all_entries = []
-        
-        for fid, fname in folders:
-            blocks = db.fetch_blocks(fid)
-            for bid, btype, data in blocks:
-                if btype == 'Credential':
-                    entry = {
-                        'id': bid,
-                        'folder': fname,
-                        'site': data.get('site', ''),
-                        'username': data.get('username', ''),
-                        'password': data.get('password', ''), # Be careful sending this
-                        'url': data.get('site', ''),  # specific for extension auto-fill
-                        'notes': data.get('notes', '')
-                    }
-                    all_entries.append(entry)
-                    
-        return jsonify({'entries': all_entries})
+        if not db.opens_vault():
+            return jsonify({'error': 'Invalid key'}), 401
+        revision, reset, rows = db.changes_since(since)
+        changes = []
+        for op, bid, fname, data in rows:
+            if op == 'delete':
+                changes.append({'op': 'delete', 'id': bid})
+            else:
+                changes.append({'op': 'upsert', 'entry': _credential_entry(bid, fname, data)})
+        return jsonify({'revision': revision, 'reset': reset, 'changes': changes})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+BLOCK_TYPES = ('Credential', 'Text', 'Table', 'Heading', 'Title', 'Paragraph', 'Quote')
+MAX_BATCH_OPS = 1000
+
+# op name -> required fields and their types
+BATCH_OPS = {
+    'add_folder': {'name': str},
+    'rename_folder': {'id': int, 'name': str},
+    'delete_folder': {'id': int},
+    'move_folder': {'id': int},
+    'add_block': {'folder_id': int, 'type': str, 'content': object},
+    'update_block': {'id': int, 'content': object},
+    'delete_block': {'id': int},
+    'move_block': {'id': int},
+}
+
+def _strings(values):
+    return all(v is None or isinstance(v, str) for v in values)
+
+def _content_error(btype, content):
+    """Error message if content does not have the shape of a btype block, or None."""
+    if btype == 'Credential':
+        if not isinstance(content, dict):
+            return 'Credential content must be an object'
+        custom = content.get('custom') or {}
+        fields = [v for k, v in content.items() if k != 'custom']
+        if not isinstance(custom, dict) or not _strings(fields) or not _strings(custom.values()):
+            return 'Credential fields must be strings'
+    elif btype == 'Table':
+        # A dict of key: value from the web form, or rows from the desktop app
+        if isinstance(content, dict):
+            ok = _strings(content.values())
+        else:
+            ok = isinstance(content, list) and all(
+                isinstance(row, list) and _strings(row) for row in content
+            )
+        if not ok:
+            return 'Table content must be an object or a list of rows of strings'
+    elif not isinstance(content, str):
+        return f'{btype} content must be a string'
+    return None
+
+def _validate_batch_op(op):
+    """Error message for a malformed batch operation, or None."""
+    if not isinstance(op, dict) or op.get('op') not in BATCH_OPS:
+        return 'unknown op'
+    for field, ftype in BATCH_OPS[op['op']].items():
+        value = op.get(field)
+        if value is None or isinstance(value, bool) or not isinstance(value, ftype):
+            return f'{field} is required'
+    if op['op'] in ('move_folder', 'move_block'):
+        if (op.get('before') is None) == (op.get('after') is None):
+            return 'give exactly one of before/after'
+        for field in ('before', 'after'):
+            value = op.get(field)
+            if value is not None and (isinstance(value, bool) or not isinstance(value, int)):
+                return f'{field} must be an id'
+    if op['op'] == 'add_block':
+        if op['type'] not in BLOCK_TYPES:
+            return 'unknown block type'
+        return _content_error(op['type'], op['content'])
+    return None
+
+def _apply_batch_op(db, op):
+    """Apply one validated operation; returns its result dict or raises."""
+    kind = op['op']
+    if kind == 'add_folder':
+        return {'id': db.add_folder(op['name'])}
+    if kind == 'add_block':
+        if not db.has_folder(op['folder_id']):
+            raise LookupError(f"folder {op['folder_id']} not found")
+        return {'id': db.add_block(op['folder_id'], op['type'], op['content'])}
+    if kind.endswith('_folder'):
+        if not db.has_folder(op['id']):
+            raise LookupError(f"folder {op['id']} not found")
+        if kind == 'rename_folder':
+            db.update_folder(op['id'], op['name'])
+        elif kind == 'delete_folder':
+            db.delete_folder(op['id'])
+        else:
+            db.move_folder(op['id'], before=op.get('before'), after=op.get('after'))
+        return {}
+    btype = db.block_type(op['id'])
+    if btype is None:
+        raise LookupError(f"block {op['id']} not found")
+    if kind == 'update_block':
+        error = _content_error(btype, op['content'])
+        if error:
+            raise ValueError(error)
+        db.update_block(op['id'], op['content'])
+    elif kind == 'delete_block':
+        db.delete_block(op['id'])
+    else:
+        db.move_block(op['id'], before=op.get('before'), after=op.get('after'))
+    return {}
+
+@app.route('/api/batch', methods=['POST'])
+def api_batch():
+    key_hex = request.headers.get('X-Vault-Key') or session.get('key')
+    if not key_hex:
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    ops = (request.get_json(silent=True) or {}).get('ops')
+    if not isinstance(ops, list) or not ops:
+        return jsonify({'error': 'ops must be a non-empty list'}), 400
+    if len(ops) > MAX_BATCH_OPS:
+        return jsonify({'error': f'at most {MAX_BATCH_OPS} ops per batch'}), 400
+    errors = [_validate_batch_op(op) for op in ops]
+    if any(errors):
+        results = [{'ok': False, 'error': e} if e else {'ok': True} for e in errors]
+        return jsonify({'success': False, 'results': results}), 400
+
+    cipher = SimpleCipher(key=bytes.fromhex(key_hex))
+    db = DatabaseManager(cipher)
+    results = []
+    try:
+        # All operations share one transaction: any failure rolls back the lot
+        with db.batch():
+            for op in ops:
+                results.append({'ok': True, **_apply_batch_op(db, op)})
+    except Exception as e:
+        failed = len(results)
+        logging.warning(f"Batch rolled back at op {failed}: {e}")
+        results = [
+            {'ok': False, 'error': str(e) if i == failed else 'rolled back'}
+            for i in range(len(ops))
+        ]
+        return jsonify({'success': False, 'failed_index': failed, 'results': results}), 409
+    return jsonify({'success': True, 'revision': db.revision(), 'results': results})
+
 @app.route('/api/add', methods=['POST'])
 def api_add_entry():
     key_hex = request.headers.get('X-Vault-Key') or session.get('key')
@@ -306,8 +649,16 @@ if __name__ == '__main__':
     print("Click the links above to open in your browser.")
     if debug:
         app.run(debug=True, host='0.0.0.0', port=port)
+    elif os.environ.get('SERVER_MODE') == 'asgi':
+        # Event-loop front end running these same views; see asgi_app.py
+        import asgi_app
+        asgi_app.run(port=port)
     else:
         if serve:
-            serve(app, host='0.0.0.0', port=port)
+            # Requests waiting on the KDF pool still hold a thread; leave
+            # room for regular traffic beyond the pool's capacity
+            threads = int(os.environ.get(
+                'WAITRESS_THREADS', 8 + kdf_pool.workers + kdf_pool.queue_limit))
+            serve(app, host='0.0.0.0', port=port, threads=threads)
         else:
             app.run(host='0.0.0.0', port=port)